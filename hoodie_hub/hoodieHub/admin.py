@@ -1,6 +1,11 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.db import transaction
+from django.db.models import DecimalField, F, Sum
 from django.utils.html import format_html
-from .models import Hoodie, Cart, CartItem, Order, OrderItem, UserProfile
+from .models import Hoodie, HoodieVariant, Cart, CartItem, Order, OrderItem, StockReservation, UserProfile
+from .reservations import adjust_stock
+from .search import search_hoodie_ids
 
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
@@ -29,11 +34,69 @@ class UserProfileAdmin(admin.ModelAdmin):
         }),
     )
 
+class HoodieVariantForm(forms.ModelForm):
+    adjust_stock = forms.IntegerField(
+        initial=0,
+        required=False,
+        help_text='Units to add, or to remove if negative'
+    )
+    
+    class Meta:
+        model = HoodieVariant
+        fields = ['size']
+
+class HoodieVariantInline(admin.TabularInline):
+    model = HoodieVariant
+    form = HoodieVariantForm
+    extra = 0
+    fields = ['size', 'stock', 'adjust_stock']
+    # Holds change stock all the time; writing back the number the form
+    # loaded would undo them, so stock only moves by adjust_stock deltas
+    readonly_fields = ['stock']
+
 @admin.register(Hoodie)
 class HoodieAdmin(admin.ModelAdmin):
     list_display = ['name', 'get_price_display', 'get_stock_display', 'get_status_display', 'created_at']
-    list_filter = ['is_active', 'created_at', 'available_sizes']
+    list_filter = ['is_active', 'created_at', 'variants__size']
     search_fields = ['name', 'description']
+    inlines = [HoodieVariantInline]
+    
+    def get_queryset(self, request):
+        # Stock totals are summed from the variants
+        return super().get_queryset(request).prefetch_related('variants')
+    
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not HoodieVariant:
+            return super().save_formset(request, form, formset, change)
+        
+        with transaction.atomic():
+            for variant in formset.save(commit=False):
+                if variant._state.adding:
+                    variant.save()
+                else:
+                    variant.save(update_fields=['size'])
+            for variant in formset.deleted_objects:
+                variant.delete()
+            formset.save_m2m()
+            
+            for variant_form in formset.forms:
+                units = variant_form.cleaned_data.get('adjust_stock')
+                if not units or variant_form in formset.deleted_forms:
+                    continue
+                variant = variant_form.instance
+                if not adjust_stock(variant.pk, units):
+                    self.message_user(
+                        request,
+                        f'{variant} has fewer than {-units} units in stock; its stock was not changed.',
+                        messages.WARNING
+                    )
+    
+    def get_search_results(self, request, queryset, search_term):
+        # Use the full-text index instead of LIKE scans over search_fields
+        ids = search_hoodie_ids(search_term, limit=None, active_only=False)
+        if ids is None or not search_term.strip():
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(id__in=ids), False
     
     def get_price_display(self, obj):
         return format_html('<strong>KES {}</strong>', f'{obj.price:,.2f}')
@@ -67,10 +130,6 @@ class HoodieAdmin(admin.ModelAdmin):
         ('Basic Information', {
             'fields': ('name', 'description', 'price')
         }),
-        ('Inventory', {
-            'fields': ('available_sizes', 'stock_quantity'),
-            'description': 'Manage product availability'
-        }),
         ('Media', {
             'fields': ('image', 'image_url'),
             'description': 'Upload an image or provide an image URL'
@@ -100,8 +159,8 @@ class OrderItemInline(admin.TabularInline):
 class OrderAdmin(admin.ModelAdmin):
     list_display = ['get_order_id', 'customer_name', 'user_display', 'get_status_badge', 'total_amount_display', 'created_at']
     list_filter = ['status', 'created_at', 'user']
-    search_fields = ['customer_name', 'phone_number', 'mpesa_receipt_number', 'user__username', 'user__email']
-    readonly_fields = ['id', 'checkout_request_id', 'merchant_request_id', 'mpesa_receipt_number', 'created_at', 'updated_at', 'get_total_amount_display', 'get_order_items']
+    search_fields = ['customer_name', 'phone_number', 'mpesa_receipt_number', 'checkout_request_id', 'user__username', 'user__email']
+    readonly_fields = ['id', 'checkout_request_id', 'merchant_request_id', 'mpesa_receipt_number', 'receipt_digest', 'created_at', 'updated_at', 'get_total_amount_display', 'get_order_items']
     inlines = [OrderItemInline]
     date_hierarchy = 'created_at'
     
@@ -180,6 +239,16 @@ class CartAdmin(admin.ModelAdmin):
     readonly_fields = ['id', 'session_key', 'created_at', 'updated_at']
     search_fields = ['user__username', 'user__email', 'session_key']
     
+    def get_queryset(self, request):
+        # Count and total in the list query instead of two queries per row
+        return super().get_queryset(request).select_related('user').annotate(
+            item_count=Sum('items__quantity'),
+            total=Sum(
+                F('items__quantity') * F('items__hoodie__price'),
+                output_field=DecimalField(max_digits=12, decimal_places=2)
+            )
+        )
+    
     def get_cart_display(self, obj):
         if obj.user:
             return format_html('👤 <strong>{}</strong>', obj.user.username)
@@ -197,7 +266,7 @@ class CartAdmin(admin.ModelAdmin):
     user_display.short_description = "User"
     
     def get_item_count_display(self, obj):
-        count = obj.get_item_count()
+        count = obj.item_count or 0
         return format_html(
             '<span style="background-color: #dbeafe; color: #0369a1; padding: 4px 8px; border-radius: 4px; font-weight: bold;">{} items</span>',
             count
@@ -205,7 +274,7 @@ class CartAdmin(admin.ModelAdmin):
     get_item_count_display.short_description = "Items"
     
     def get_total_display(self, obj):
-        return format_html('<strong style="color: green;">KES {}</strong>', f'{obj.get_total():,.2f}')
+        return format_html('<strong style="color: green;">KES {}</strong>', f'{obj.total or 0:,.2f}')
     get_total_display.short_description = "Total"
     
     fieldsets = (
@@ -241,3 +310,19 @@ class CartItemAdmin(admin.ModelAdmin):
     def get_subtotal_display(self, obj):
         return format_html('<strong>KES {}</strong>', f'{obj.get_subtotal():,.2f}')
     get_subtotal_display.short_description = "Subtotal"
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ['get_variant_display', 'quantity', 'status', 'holder', 'order', 'expires_at']
+    list_filter = ['status']
+    search_fields = ['holder', 'variant__hoodie__name']
+    readonly_fields = ['id', 'variant', 'holder', 'order', 'quantity', 'status', 'expires_at', 'created_at']
+    list_select_related = ['variant__hoodie', 'order']
+    
+    def get_variant_display(self, obj):
+        return f"{obj.variant.hoodie.name} ({obj.variant.size})"
+    get_variant_display.short_description = "Item"
+    
+    def has_add_permission(self, request):
+        # Holds must go through hoodieHub.reservations so stock stays in step
+        return False
@@ -0,0 +1,580 @@
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.core import signing
+from django.db import transaction
+from django.db.models import DecimalField, Exists, ExpressionWrapper, F, OuterRef, Subquery, Sum
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Hoodie, Cart, CartItem
+from .reservations import transfer_holds
+
+LINE_TOTAL = ExpressionWrapper(
+    F('quantity') * F('hoodie__price'),
+    output_field=DecimalField(max_digits=12, decimal_places=2)
+)
+# SQLite hands computed decimals back unquantized (e.g. 200 for 200.00)
+CENTS = Decimal('0.01')
+
+
+class CartSummary:
+    """Cart lines, item count and total loaded in a fixed number of queries"""
+
+    def __init__(self, items, item_count, total):
+        self.items = items
+        self.item_count = item_count
+        self.total = total.quantize(CENTS)
+
+    @classmethod
+    def empty(cls):
+        return cls([], 0, Decimal('0.00'))
+
+    @classmethod
+    def for_cart(cls, cart):
+        """Lines with their hoodie and line total, plus count and total, in one query"""
+        if cart is None:
+            return cls.empty()
+
+        items = list(
+            CartItem.objects
+            .filter(cart=cart)
+            .select_related('hoodie')
+            .annotate(line_total=LINE_TOTAL)
+            .order_by('created_at')
+        )
+        return cls(
+            items,
+            sum(item.quantity for item in items),
+            sum((item.line_total for item in items), Decimal('0.00'))
+        )
+
+    @classmethod
+    def totals(cls, cart):
+        """Count and total only, from a single aggregate query"""
+        if cart is None:
+            return cls.empty()
+
+        totals = CartItem.objects.filter(cart=cart).aggregate(
+            item_count=Sum('quantity'),
+            total=Sum(LINE_TOTAL)
+        )
+        return cls(
+            None,
+            totals['item_count'] or 0,
+            totals['total'] or Decimal('0.00')
+        )
+
+    def is_empty(self):
+        return self.item_count == 0
+
+    def as_dict(self):
+        """JSON-friendly summary for the AJAX cart endpoints"""
+        return {
+            'item_count': self.item_count,
+            'total': str(self.total),
+            'items': [
+                {
+                    'id': str(item.id),
+                    'hoodie_name': item.hoodie.name,
+                    'size': item.size,
+                    'quantity': item.quantity,
+                    'price': str(item.hoodie.price),
+                    'subtotal': str(item.line_total.quantize(CENTS))
+                }
+                for item in self.items or []
+            ]
+        }
+
+
+# ========== CART STORAGE ==========
+
+class CartFull(Exception):
+    pass
+
+
+class CartBatchError(Exception):
+    pass
+
+
+class BaseCartStorage:
+    """Where a visitor's cart lives.
+
+    Views talk to carts only through this interface. Authenticated users
+    always use DatabaseCartStorage; guests use settings.CART_GUEST_STORAGE.
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+    def get_summary(self):
+        """CartSummary with lines, count and total"""
+        raise NotImplementedError
+
+    def get_totals(self):
+        """CartSummary with count and total only"""
+        return self.get_summary()
+
+    def get_quantity(self, hoodie_id, size):
+        """Quantity of (hoodie, size) already in the cart"""
+        raise NotImplementedError
+
+    def get_line(self, item_id):
+        """The cart line with this id (hoodie_id, size, quantity), or None"""
+        raise NotImplementedError
+
+    def get_holder(self):
+        """Identifies this cart's stock reservations"""
+        raise NotImplementedError
+
+    def add(self, hoodie, size, quantity):
+        raise NotImplementedError
+
+    def set_quantity(self, item_id, quantity):
+        """Change a line's quantity (removing it at 0); False if no such line"""
+        raise NotImplementedError
+
+    def remove(self, item_id):
+        """Remove a line; False if no such line"""
+        raise NotImplementedError
+
+    def set_lines(self, quantities):
+        """Set many lines at once from {(hoodie_id, size): quantity}; 0 removes a line"""
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def merge_into(self, user):
+        """Move every line into ``user``'s database cart and empty this one"""
+        raise NotImplementedError
+
+    def take_over(self, cart):
+        """Replace this cart's contents with the lines of ``cart``, then delete it"""
+        raise NotImplementedError
+
+    def update_response(self, response):
+        """Persist any pending changes on the response (called by middleware)"""
+
+
+class DatabaseCartStorage(BaseCartStorage):
+    """Cart rows keyed by user, or by a session key for guests (the default)"""
+
+    def __init__(self, request):
+        super().__init__(request)
+        # Remember who the visitor was, so a guest storage still finds the
+        # guest cart after login() has replaced request.user
+        self.user = request.user
+        self._cart = None
+
+    def get_cart(self, create=False):
+        """The visitor's Cart row; only created when ``create`` is set"""
+        if self._cart is not None:
+            return self._cart
+        
+        user = self.user
+        if user.is_authenticated:
+            # For authenticated users, use user-based cart
+            if create:
+                self._cart, created = Cart.objects.get_or_create(user=user)
+            else:
+                self._cart = Cart.objects.filter(user=user).first()
+        else:
+            # For anonymous users, use session-based cart
+            session_key = self.request.session.get('cart_session')
+            if session_key is None and create:
+                session_key = str(uuid.uuid4())
+                self.request.session['cart_session'] = session_key
+            if session_key is not None:
+                if create:
+                    self._cart, created = Cart.objects.get_or_create(session_key=session_key)
+                else:
+                    self._cart = Cart.objects.filter(session_key=session_key).first()
+        
+        return self._cart
+
+    def _touch(self):
+        # Cart.updated_at is what purge_stale_carts ages carts by
+        if self._cart is not None:
+            Cart.objects.filter(pk=self._cart.pk).update(updated_at=timezone.now())
+
+    def _items(self):
+        cart = self.get_cart()
+        if cart is None:
+            return CartItem.objects.none()
+        return CartItem.objects.filter(cart=cart)
+
+    def get_summary(self):
+        return CartSummary.for_cart(self.get_cart())
+
+    def get_totals(self):
+        return CartSummary.totals(self.get_cart())
+
+    def get_quantity(self, hoodie_id, size):
+        quantity = self._items().filter(hoodie_id=hoodie_id, size=size).values_list('quantity', flat=True).first()
+        return quantity or 0
+
+    def get_line(self, item_id):
+        item_id = _parse_item_id(item_id)
+        if item_id is None:
+            return None
+        return self._items().filter(id=item_id).only('hoodie_id', 'size', 'quantity').first()
+
+    def get_holder(self):
+        return cart_holder(self.get_cart(create=True))
+
+    def add(self, hoodie, size, quantity):
+        cart = self.get_cart(create=True)
+        cart_item, created = CartItem.objects.get_or_create(
+            cart=cart,
+            hoodie=hoodie,
+            size=size,
+            defaults={'quantity': quantity}
+        )
+        if not created:
+            CartItem.objects.filter(pk=cart_item.pk).update(quantity=F('quantity') + quantity)
+        self._touch()
+
+    def set_quantity(self, item_id, quantity):
+        item_id = _parse_item_id(item_id)
+        if item_id is None:
+            return False
+        if quantity <= 0:
+            return self.remove(item_id)
+        updated = self._items().filter(id=item_id).update(quantity=quantity) > 0
+        if updated:
+            self._touch()
+        return updated
+
+    def remove(self, item_id):
+        item_id = _parse_item_id(item_id)
+        if item_id is None:
+            return False
+        deleted, _ = self._items().filter(id=item_id).delete()
+        if deleted:
+            self._touch()
+        return deleted > 0
+
+    def set_lines(self, quantities):
+        cart = self.get_cart(create=True)
+        existing = {
+            (item.hoodie_id, item.size): item
+            for item in CartItem.objects.filter(cart=cart).only('id', 'hoodie_id', 'size', 'quantity')
+        }
+        
+        changed, new, removed = [], [], []
+        for (hoodie_id, size), quantity in quantities.items():
+            item = existing.get((hoodie_id, size))
+            if item is None:
+                if quantity > 0:
+                    new.append(CartItem(cart=cart, hoodie_id=hoodie_id, size=size, quantity=quantity))
+            elif quantity <= 0:
+                removed.append(item.pk)
+            elif quantity != item.quantity:
+                item.quantity = quantity
+                changed.append(item)
+        
+        with transaction.atomic():
+            if removed:
+                CartItem.objects.filter(pk__in=removed).delete()
+            if changed:
+                CartItem.objects.bulk_update(changed, ['quantity'])
+            if new:
+                CartItem.objects.bulk_create(new)
+            self._touch()
+
+    def clear(self):
+        self._items().delete()
+
+    def merge_into(self, user):
+        source = self.get_cart()
+        if source is None or source.user_id == user.pk:
+            return
+        
+        with transaction.atomic():
+            cart, created = Cart.objects.get_or_create(user=user)
+            merge_carts(source, cart)
+            transfer_holds(cart_holder(source), cart_holder(cart))
+        self._cart = None
+        self.request.session.pop('cart_session', None)
+
+    def take_over(self, cart):
+        with transaction.atomic():
+            target = self.get_cart(create=True)
+            merge_carts(cart, target)
+            transfer_holds(cart_holder(cart), cart_holder(target))
+
+
+class SignedCookieCartStorage(BaseCartStorage):
+    """Guest cart kept in a signed, compressed cookie.
+
+    Browsing and filling a cart costs no database writes for the cart
+    itself; lines only become rows at checkout (as order items) or at login
+    (merged into the user's cart). Lines are stored as [hoodie_id, size,
+    quantity], next to a random token that identifies the cart's stock holds.
+    """
+    salt = 'hoodieHub.cart'
+
+    def __init__(self, request):
+        super().__init__(request)
+        self._changed = False
+        self._token, self._lines = self._load()
+
+    def _load(self):
+        cookie = self.request.COOKIES.get(settings.CART_COOKIE_NAME)
+        if not cookie:
+            return None, []
+        try:
+            data = signing.loads(cookie, salt=self.salt, max_age=settings.CART_COOKIE_AGE)
+            token = data.get('token')
+            if token is not None:
+                token = uuid.UUID(token).hex
+            return token, [
+                [uuid.UUID(hoodie_id).hex, str(size), int(quantity)]
+                for hoodie_id, size, quantity in data.get('lines', [])
+                if int(quantity) > 0
+            ]
+        except (signing.BadSignature, ValueError, TypeError, AttributeError):
+            # Tampered, expired or malformed: start over with an empty cart
+            self._changed = True
+            return None, []
+
+    def _find(self, item_id):
+        item_id = _parse_item_id(item_id)
+        for line in self._lines:
+            if item_id is not None and cookie_line_id(line[0], line[1]) == item_id:
+                return line
+        return None
+
+    def get_summary(self):
+        if not self._lines:
+            return CartSummary.empty()
+        
+        hoodies = Hoodie.objects.in_bulk([uuid.UUID(line[0]) for line in self._lines])
+        items = []
+        for hoodie_id, size, quantity in self._lines:
+            hoodie = hoodies.get(uuid.UUID(hoodie_id))
+            if hoodie is None:
+                continue
+            item = CartItem(id=cookie_line_id(hoodie_id, size), hoodie=hoodie, size=size, quantity=quantity)
+            item.line_total = hoodie.price * quantity
+            items.append(item)
+        
+        return CartSummary(
+            items,
+            sum(item.quantity for item in items),
+            sum((item.line_total for item in items), Decimal('0.00'))
+        )
+
+    def get_quantity(self, hoodie_id, size):
+        hoodie_id = uuid.UUID(str(hoodie_id)).hex
+        for line in self._lines:
+            if line[0] == hoodie_id and line[1] == size:
+                return line[2]
+        return 0
+
+    def get_line(self, item_id):
+        line = self._find(item_id)
+        if line is None:
+            return None
+        hoodie_id, size, quantity = line
+        return CartItem(id=cookie_line_id(hoodie_id, size), hoodie_id=uuid.UUID(hoodie_id), size=size, quantity=quantity)
+
+    def get_holder(self):
+        if self._token is None:
+            self._token = uuid.uuid4().hex
+            self._changed = True
+        return f'guest:{self._token}'
+
+    def add(self, hoodie, size, quantity):
+        hoodie_id = hoodie.id.hex
+        for line in self._lines:
+            if line[0] == hoodie_id and line[1] == size:
+                line[2] += quantity
+                break
+        else:
+            if len(self._lines) >= settings.CART_COOKIE_MAX_LINES:
+                raise CartFull()
+            self._lines.append([hoodie_id, size, quantity])
+        self._changed = True
+
+    def set_quantity(self, item_id, quantity):
+        line = self._find(item_id)
+        if line is None:
+            return False
+        if quantity <= 0:
+            self._lines.remove(line)
+        else:
+            line[2] = quantity
+        self._changed = True
+        return True
+
+    def remove(self, item_id):
+        line = self._find(item_id)
+        if line is None:
+            return False
+        self._lines.remove(line)
+        self._changed = True
+        return True
+
+    def set_lines(self, quantities):
+        lines = {(uuid.UUID(hoodie_id), size): quantity for hoodie_id, size, quantity in self._lines}
+        lines.update(quantities)
+        lines = [
+            [hoodie_id.hex, size, quantity]
+            for (hoodie_id, size), quantity in lines.items()
+            if quantity > 0
+        ]
+        if len(lines) > settings.CART_COOKIE_MAX_LINES:
+            raise CartFull()
+        self._lines = lines
+        self._changed = True
+
+    def clear(self):
+        if self._lines:
+            self._lines = []
+            self._changed = True
+
+    def merge_into(self, user):
+        if not self._lines:
+            return
+        
+        with transaction.atomic():
+            cart, created = Cart.objects.get_or_create(user=user)
+            add_lines(cart, [(uuid.UUID(hoodie_id), size, quantity) for hoodie_id, size, quantity in self._lines])
+            if self._token is not None:
+                transfer_holds(self.get_holder(), cart_holder(cart))
+        self.clear()
+
+    def take_over(self, cart):
+        self._lines = [
+            [hoodie_id.hex, size, quantity]
+            for hoodie_id, size, quantity in cart.items.values_list('hoodie_id', 'size', 'quantity')
+        ][:settings.CART_COOKIE_MAX_LINES]
+        self._changed = True
+        transfer_holds(cart_holder(cart), self.get_holder())
+        cart.delete()
+
+    def update_response(self, response):
+        if not self._changed:
+            return
+        if not self._lines:
+            response.delete_cookie(settings.CART_COOKIE_NAME, samesite='Lax')
+            return
+        response.set_cookie(
+            settings.CART_COOKIE_NAME,
+            signing.dumps({'token': self._token, 'lines': self._lines}, salt=self.salt, compress=True),
+            max_age=settings.CART_COOKIE_AGE,
+            secure=settings.SESSION_COOKIE_SECURE,
+            httponly=True,
+            samesite='Lax'
+        )
+
+
+# ========== SET-BASED CART MERGE ==========
+
+def cart_holder(cart):
+    """Reservation holder id of a database cart"""
+    return f'cart:{cart.pk}'
+
+
+def _lock_carts(*carts):
+    """Lock cart rows in primary key order, so two merges can't deadlock"""
+    pks = sorted(cart.pk for cart in carts)
+    list(Cart.objects.select_for_update().filter(pk__in=pks).order_by('pk').values_list('pk', flat=True))
+
+
+def merge_carts(source, target):
+    """Move every line of ``source`` into ``target`` and delete ``source``.
+
+    Runs a fixed number of statements however big the carts are: lines
+    already in ``target`` get the source quantity added, the source copies
+    of those lines are deleted, and the rest are moved across in one UPDATE.
+    Must be called inside a transaction.
+    """
+    if source.pk == target.pk:
+        return
+    
+    _lock_carts(source, target)
+    
+    source_line = CartItem.objects.filter(cart=source, hoodie=OuterRef('hoodie'), size=OuterRef('size'))
+    target_line = CartItem.objects.filter(cart=target, hoodie=OuterRef('hoodie'), size=OuterRef('size'))
+    
+    # Upsert the (hoodie, size) lines both carts have
+    CartItem.objects.filter(cart=target).filter(Exists(source_line)).update(
+        quantity=F('quantity') + Subquery(source_line.values('quantity')[:1])
+    )
+    CartItem.objects.filter(cart=source).filter(Exists(target_line)).delete()
+    
+    # Everything left in the source cart is new to the target
+    CartItem.objects.filter(cart=source).update(cart=target)
+    Cart.objects.filter(pk=source.pk).delete()
+    Cart.objects.filter(pk=target.pk).update(updated_at=timezone.now())
+
+
+def add_lines(cart, lines):
+    """Add (hoodie_id, size, quantity) lines to ``cart`` in bulk.
+
+    Must be called inside a transaction.
+    """
+    _lock_carts(cart)
+    
+    quantities = {}
+    for hoodie_id, size, quantity in lines:
+        quantities[(hoodie_id, size)] = quantities.get((hoodie_id, size), 0) + quantity
+    
+    # Only lines for hoodies that still exist can be stored
+    existing_hoodies = set(Hoodie.objects.filter(
+        id__in={hoodie_id for hoodie_id, size in quantities}
+    ).values_list('id', flat=True))
+    
+    existing = []
+    for item in CartItem.objects.filter(cart=cart, hoodie_id__in=existing_hoodies):
+        quantity = quantities.pop((item.hoodie_id, item.size), None)
+        if quantity is not None:
+            item.quantity += quantity
+            existing.append(item)
+    
+    Cart.objects.filter(pk=cart.pk).update(updated_at=timezone.now())
+    CartItem.objects.bulk_update(existing, ['quantity'])
+    CartItem.objects.bulk_create([
+        CartItem(cart=cart, hoodie_id=hoodie_id, size=size, quantity=quantity)
+        for (hoodie_id, size), quantity in quantities.items()
+        if hoodie_id in existing_hoodies
+    ])
+
+
+# Namespace for the stable ids of cookie cart lines
+COOKIE_LINE_NAMESPACE = uuid.UUID('6f1c2a4e-93b5-4c7d-8e2f-0a9b1c3d5e7f')
+
+
+def cookie_line_id(hoodie_id, size):
+    """Stable UUID for a cookie cart line, so it works with the item_id URLs"""
+    return uuid.uuid5(COOKIE_LINE_NAMESPACE, f'{uuid.UUID(str(hoodie_id)).hex}:{size}')
+
+
+def _parse_item_id(item_id):
+    try:
+        return uuid.UUID(str(item_id))
+    except ValueError:
+        return None
+
+
+def get_cart_storage(request, refresh=False):
+    """Cart storage for this request (one instance per request).
+
+    Pass ``refresh`` after login/logout so the storage matches the new user.
+    """
+    storage = getattr(request, '_cart_storage', None)
+    if storage is None or refresh:
+        if request.user.is_authenticated:
+            storage = DatabaseCartStorage(request)
+        else:
+            storage = get_guest_storage_class()(request)
+        request._cart_storage = storage
+    return storage
+
+
+def get_guest_storage_class():
+    return import_string(settings.CART_GUEST_STORAGE)
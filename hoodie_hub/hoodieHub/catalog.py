@@ -0,0 +1,200 @@
+import base64
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Hoodie
+
+# Shared (cross-process) cache keys
+CATALOG_VERSION_KEY = 'hoodieHub:catalog:version'
+CATALOG_PAGE_KEY = 'hoodieHub:catalog:page:{version}:{cursor}'
+HOODIE_MODIFIED_KEY = 'hoodieHub:hoodie:{hoodie_id}:modified'
+
+# In-process tier sitting in front of the shared cache. Pages are kept in
+# a small LRU so arbitrary cursors cannot grow it without bound.
+_local_lock = threading.Lock()
+_local = {
+    'version': None,
+    'checked_at': 0.0,
+    'pages': OrderedDict(),
+}
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(hoodie):
+    """Opaque cursor pointing just past ``hoodie`` in catalog order"""
+    raw = f"{hoodie.created_at.isoformat()}|{hoodie.id.hex}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (created_at, id) for a cursor produced by encode_cursor"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, hoodie_id = base64.urlsafe_b64decode(padded).decode().split('|')
+        created_at = parse_datetime(created_at)
+        hoodie_id = uuid.UUID(hoodie_id)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+    if created_at is None:
+        raise InvalidCursor(cursor)
+    return created_at, hoodie_id
+
+
+def get_catalog_version():
+    """Current catalog version, initialised on first use"""
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Seed with a timestamp so a flushed cache never reuses an old version
+        cache.add(CATALOG_VERSION_KEY, int(time.time()), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    """Move the catalog to a new version and return it"""
+    try:
+        version = cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        version = int(time.time())
+        cache.set(CATALOG_VERSION_KEY, version, timeout=None)
+
+    with _local_lock:
+        _local['version'] = None
+        _local['checked_at'] = 0.0
+        _local['pages'].clear()
+
+    return version
+
+
+def build_catalog_page(cursor=None):
+    """Load one page of the active catalog using keyset pagination.
+
+    Rows are walked in (created_at, id) descending order, which matches the
+    (is_active, created_at, id) index, so a page costs the same no matter
+    how deep into the catalog it is.
+    """
+    hoodies = Hoodie.objects.filter(is_active=True).prefetch_related('variants')
+    if cursor:
+        created_at, hoodie_id = decode_cursor(cursor)
+        hoodies = hoodies.filter(
+            Q(created_at__lt=created_at) |
+            Q(created_at=created_at, id__lt=hoodie_id)
+        )
+
+    page_size = settings.CATALOG_PAGE_SIZE
+    # Fetch one extra row to know whether there is a next page
+    rows = list(hoodies.order_by('-created_at', '-id')[:page_size + 1])
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1])
+
+    return {
+        'hoodies': rows,
+        'next_cursor': next_cursor,
+    }
+
+
+def rebuild_catalog():
+    """Bump the version and eagerly store a fresh first page under it"""
+    version = bump_catalog_version()
+    page = build_catalog_page()
+    cache.set(
+        CATALOG_PAGE_KEY.format(version=version, cursor=''),
+        page,
+        settings.CATALOG_CACHE_TIMEOUT
+    )
+    _store_local(version, '', page)
+    return version, page
+
+
+def get_catalog_page(cursor=None):
+    """Return (version, page) for the given cursor.
+
+    Served from the in-process tier when its version was checked recently,
+    then from the shared cache, and only built from the database when the
+    page for the current version is missing. Raises InvalidCursor for
+    cursors that were not produced by encode_cursor.
+    """
+    cursor = cursor or ''
+    now = time.monotonic()
+    with _local_lock:
+        local_version = _local['version']
+        local_page = _local['pages'].get(cursor)
+        fresh = now - _local['checked_at'] < settings.CATALOG_LOCAL_TTL
+        if local_page is not None and fresh:
+            _local['pages'].move_to_end(cursor)
+            return local_version, local_page
+
+    version = get_catalog_version()
+
+    if version != local_version:
+        with _local_lock:
+            _local['pages'].clear()
+        local_page = None
+
+    page = local_page
+    if page is None:
+        page_key = CATALOG_PAGE_KEY.format(version=version, cursor=cursor)
+        page = cache.get(page_key)
+        if page is None:
+            page = build_catalog_page(cursor)
+            cache.set(page_key, page, settings.CATALOG_CACHE_TIMEOUT)
+
+    _store_local(version, cursor, page)
+    return version, page
+
+
+def _store_local(version, cursor, page):
+    with _local_lock:
+        if _local['version'] != version:
+            _local['pages'].clear()
+        _local['version'] = version
+        _local['checked_at'] = time.monotonic()
+        _local['pages'][cursor] = page
+        _local['pages'].move_to_end(cursor)
+        while len(_local['pages']) > settings.CATALOG_LOCAL_MAX_PAGES:
+            _local['pages'].popitem(last=False)
+
+
+def get_hoodie_modified(hoodie_id):
+    """When a hoodie's page content last changed, or None if it doesn't exist.
+
+    Kept in the shared cache and written through by the Hoodie signals, so
+    revalidating a product page normally needs no database query.
+    """
+    key = HOODIE_MODIFIED_KEY.format(hoodie_id=hoodie_id)
+    modified = cache.get(key)
+    if modified is None:
+        modified = Hoodie.objects.filter(id=hoodie_id).values_list('updated_at', flat=True).first()
+        if modified is not None:
+            cache.set(key, modified, settings.CATALOG_CACHE_TIMEOUT)
+    return modified
+
+
+def set_hoodie_modified(hoodie_id, modified):
+    cache.set(HOODIE_MODIFIED_KEY.format(hoodie_id=hoodie_id), modified, settings.CATALOG_CACHE_TIMEOUT)
+
+
+def forget_hoodie(hoodie_id):
+    cache.delete(HOODIE_MODIFIED_KEY.format(hoodie_id=hoodie_id))
+
+
+def touch_hoodie(hoodie_id):
+    """Mark a hoodie's page as changed when a related row (e.g. a variant) changes"""
+    modified = timezone.now()
+    Hoodie.objects.filter(id=hoodie_id).update(updated_at=modified)
+    set_hoodie_modified(hoodie_id, modified)
+    return modified
@@ -0,0 +1,152 @@
+"""Resized WebP/JPEG derivatives of hoodie images.
+
+Derivatives are content-addressed by the SHA-256 of the uploaded file, so
+an unchanged upload is never resized twice and a replaced upload can never
+be served from a stale URL. Resizing runs in a process pool after the
+admin's save has committed, never in the request itself.
+"""
+import hashlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+
+# Worker processes import this module before Django is set up, so models
+# are only imported inside the functions that run in the web process.
+
+DERIVATIVES_DIR = 'derivatives'
+
+# Rendition name -> target width in pixels
+RENDITIONS = {
+    'thumbnail': 160,
+    'card': 480,
+    'detail': 960,
+}
+
+# Extension -> (Pillow format, save options)
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def derivative_name(digest, width, extension):
+    """Storage name of one derivative, relative to MEDIA_ROOT"""
+    return f'{DERIVATIVES_DIR}/{digest[:2]}/{digest}/{width}.{extension}'
+
+
+def file_digest(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def build_derivatives(source_path, media_root):
+    """Write every rendition of ``source_path`` and return its digest.
+
+    Runs in a worker process, so it only touches the filesystem and Pillow.
+    Files that already exist are left alone.
+    """
+    from PIL import Image, ImageOps
+
+    digest = file_digest(source_path)
+    targets = []
+    for width in sorted(set(RENDITIONS.values())):
+        for extension in FORMATS:
+            path = os.path.join(media_root, derivative_name(digest, width, extension))
+            if not os.path.exists(path):
+                targets.append((width, extension, path))
+
+    if not targets:
+        return digest
+
+    with Image.open(source_path) as original:
+        original = ImageOps.exif_transpose(original)
+        if original.mode != 'RGB':
+            original = original.convert('RGB')
+
+        resized = {}
+        for width in {width for width, _, _ in targets}:
+            image = original.copy()
+            # Never upscale past the original
+            image.thumbnail((min(width, image.width), image.height * 10), Image.Resampling.LANCZOS)
+            resized[width] = image
+
+        for width, extension, path in targets:
+            pillow_format, options = FORMATS[extension]
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename so a half-written file is never served
+            temp_path = f'{path}.{os.getpid()}.tmp'
+            resized[width].save(temp_path, pillow_format, **options)
+            os.replace(temp_path, path)
+
+    return digest
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn rather than fork: the web process has threads and open DB connections
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_DERIVATIVE_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _executor
+
+
+def schedule_derivatives(hoodie):
+    """Queue derivative generation for a hoodie's current image"""
+    if not hoodie.image:
+        return None
+
+    hoodie_id, image_name = hoodie.pk, hoodie.image.name
+    future = _get_executor().submit(build_derivatives, hoodie.image.path, str(settings.MEDIA_ROOT))
+    future.add_done_callback(
+        lambda done: _record_digest(hoodie_id, image_name, done)
+    )
+    return future
+
+
+def _record_digest(hoodie_id, image_name, future):
+    """Store the digest once derivatives are on disk (runs off the request thread)"""
+    from django.db import close_old_connections, connection
+    from django.utils import timezone
+    from .catalog import rebuild_catalog, set_hoodie_modified
+    from .models import Hoodie
+
+    try:
+        digest = future.result()
+    except Exception as e:
+        print(f"Error building image derivatives for {hoodie_id}: {e}")
+        return
+
+    close_old_connections()
+    try:
+        # Skip if the image was replaced while this one was being resized
+        modified = timezone.now()
+        updated = Hoodie.objects.filter(pk=hoodie_id, image=image_name).exclude(
+            image_digest=digest
+        ).update(image_digest=digest, updated_at=modified)
+        if updated:
+            set_hoodie_modified(hoodie_id, modified)
+            rebuild_catalog()
+    finally:
+        connection.close()
+
+
+def derivative_urls(hoodie, extension):
+    """Return [(url, width), ...] for every rendition of the hoodie image"""
+    if not hoodie.image or not hoodie.image_digest:
+        return []
+    return [
+        (f'{settings.MEDIA_URL}{derivative_name(hoodie.image_digest, width, extension)}', width)
+        for width in sorted(set(RENDITIONS.values()))
+    ]
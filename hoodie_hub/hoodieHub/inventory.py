@@ -0,0 +1,16 @@
+from django.core.exceptions import ValidationError
+
+from .models import HoodieVariant
+
+
+def get_variant(hoodie_id, size):
+    """Look up the active variant for (hoodie, size), or None"""
+    try:
+        return HoodieVariant.objects.select_related('hoodie').get(
+            hoodie_id=hoodie_id,
+            size=size,
+            hoodie__is_active=True
+        )
+    except (HoodieVariant.DoesNotExist, ValidationError):
+        return None
+
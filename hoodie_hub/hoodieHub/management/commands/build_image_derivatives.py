@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from hoodieHub.catalog import rebuild_catalog, set_hoodie_modified
+from hoodieHub.images import build_derivatives
+from hoodieHub.models import Hoodie
+
+class Command(BaseCommand):
+    help = 'Build resized image derivatives for hoodies that are missing them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Check every hoodie, not just ones without a digest')
+
+    def handle(self, *args, **options):
+        hoodies = Hoodie.objects.exclude(image='').exclude(image__isnull=True)
+        if not options['all']:
+            hoodies = hoodies.filter(image_digest='')
+        
+        updated = 0
+        for hoodie in hoodies.only('id', 'image', 'image_digest').iterator():
+            try:
+                digest = build_derivatives(hoodie.image.path, str(settings.MEDIA_ROOT))
+            except (OSError, ValueError) as e:
+                self.stdout.write(self.style.ERROR(f'Failed: {hoodie.image.name} ({e})'))
+                continue
+            
+            if digest != hoodie.image_digest:
+                modified = timezone.now()
+                Hoodie.objects.filter(pk=hoodie.pk).update(image_digest=digest, updated_at=modified)
+                set_hoodie_modified(hoodie.pk, modified)
+                updated += 1
+            self.stdout.write(self.style.SUCCESS(f'Built: {hoodie.image.name}'))
+        
+        if updated:
+            rebuild_catalog()
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} hoodies'))
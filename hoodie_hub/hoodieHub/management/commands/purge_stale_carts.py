@@ -0,0 +1,59 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from hoodieHub.models import Cart
+
+class Command(BaseCommand):
+    help = 'Delete abandoned guest carts and expired sessions in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows deleted per statement')
+        parser.add_argument('--sleep', type=float, default=0.1, help='Seconds to pause between batches')
+        parser.add_argument('--loop', action='store_true', help='Keep running, purging every --interval seconds')
+        parser.add_argument('--interval', type=float, default=3600, help='Seconds between passes with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            carts = self.purge_carts(options['batch_size'], options['sleep'])
+            sessions = self.purge_sessions(options['batch_size'], options['sleep'])
+            self.stdout.write(self.style.SUCCESS(f'Deleted {carts} stale carts and {sessions} expired sessions'))
+            
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def purge_carts(self, batch_size, pause):
+        cutoff = timezone.now() - timedelta(seconds=settings.CART_GUEST_MAX_AGE)
+        stale = Cart.objects.filter(user__isnull=True, updated_at__lt=cutoff)
+        
+        # Walk the updated_at index a batch at a time so no statement holds locks for long
+        return self._delete_in_batches(stale.order_by('updated_at'), Cart, 'carts', batch_size, pause)
+
+    def purge_sessions(self, batch_size, pause):
+        if settings.SESSION_ENGINE not in ('django.contrib.sessions.backends.db', 'django.contrib.sessions.backends.cached_db'):
+            # Other backends expire sessions themselves (or via clearsessions)
+            return 0
+        
+        expired = Session.objects.filter(expire_date__lt=timezone.now()).order_by('expire_date')
+        return self._delete_in_batches(expired, Session, 'sessions', batch_size, pause)
+
+    def _delete_in_batches(self, queryset, model, label, batch_size, pause):
+        deleted = 0
+        while True:
+            pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            
+            # Deleting a batch of carts also deletes their items
+            model.objects.filter(pk__in=pks).delete()
+            deleted += len(pks)
+            self.stdout.write(f'  {label}: {deleted} deleted')
+            
+            if len(pks) < batch_size:
+                break
+            time.sleep(pause)
+        return deleted
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from hoodieHub.search import is_supported, rebuild_index
+
+class Command(BaseCommand):
+    help = 'Rebuild the product full-text search index'
+
+    def handle(self, *args, **kwargs):
+        if not is_supported():
+            self.stdout.write(self.style.WARNING('This database has no full-text index, nothing to rebuild'))
+            return
+        
+        count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} hoodies'))
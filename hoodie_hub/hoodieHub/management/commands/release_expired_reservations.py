@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from hoodieHub.reservations import release_expired
+
+class Command(BaseCommand):
+    help = 'Release stock held by expired cart and checkout reservations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Reservations released per transaction')
+        parser.add_argument('--loop', action='store_true', help='Keep running, sweeping every --interval seconds')
+        parser.add_argument('--interval', type=float, default=30, help='Seconds between sweeps with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            released = 0
+            while True:
+                # Small batches keep each transaction (and its row locks) short
+                count = release_expired(options['batch_size'])
+                released += count
+                if count < options['batch_size']:
+                    break
+            
+            if released or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Released {released} expired reservations'))
+            
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,32 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+
+class CartStorageMiddleware:
+    """Let the request's cart storage write its changes (e.g. a cookie) to the response"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Stay on the event loop under ASGI instead of forcing a thread hop
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        response = self.get_response(request)
+        self.update_response(request, response)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        self.update_response(request, response)
+        return response
+
+    def update_response(self, request, response):
+        storage = getattr(request, '_cart_storage', None)
+        if storage is not None:
+            storage.update_response(response)
@@ -0,0 +1,17 @@
+# Generated by Django 6.0.1 on 2026-10-17 22:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hoodieHub', '0004_alter_order_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='hoodie',
+            index=models.Index(fields=['is_active', 'created_at', 'id'], name='hoodie_active_created_idx'),
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 6.0.1 on 2026-10-17 22:47
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+def split_sizes_into_variants(apps, schema_editor):
+    """Create one variant per size in available_sizes.
+
+    The old stock_quantity was shared by every size, so it is split as
+    evenly as possible across them to keep the total unchanged.
+    """
+    Hoodie = apps.get_model('hoodieHub', 'Hoodie')
+    HoodieVariant = apps.get_model('hoodieHub', 'HoodieVariant')
+    
+    variants = []
+    for hoodie in Hoodie.objects.only('id', 'available_sizes', 'stock_quantity').iterator():
+        sizes = []
+        for size in (hoodie.available_sizes or '').split(','):
+            size = size.strip().upper()
+            if size and size not in sizes:
+                sizes.append(size)
+        if not sizes:
+            continue
+        
+        per_size, remainder = divmod(max(hoodie.stock_quantity, 0), len(sizes))
+        for index, size in enumerate(sizes):
+            variants.append(HoodieVariant(
+                hoodie_id=hoodie.id,
+                size=size,
+                stock=per_size + (1 if index < remainder else 0)
+            ))
+    
+    HoodieVariant.objects.bulk_create(variants, batch_size=500)
+
+
+def join_variants_into_sizes(apps, schema_editor):
+    Hoodie = apps.get_model('hoodieHub', 'Hoodie')
+    HoodieVariant = apps.get_model('hoodieHub', 'HoodieVariant')
+    size_order = ['S', 'M', 'L', 'XL']
+    
+    variants_by_hoodie = {}
+    for variant in HoodieVariant.objects.all().iterator():
+        variants_by_hoodie.setdefault(variant.hoodie_id, []).append(variant)
+    
+    hoodies = []
+    for hoodie in Hoodie.objects.filter(id__in=variants_by_hoodie.keys()):
+        variants = sorted(
+            variants_by_hoodie[hoodie.id],
+            key=lambda variant: size_order.index(variant.size) if variant.size in size_order else len(size_order)
+        )
+        hoodie.available_sizes = ','.join(variant.size for variant in variants)
+        hoodie.stock_quantity = sum(variant.stock for variant in variants)
+        hoodies.append(hoodie)
+    
+    Hoodie.objects.bulk_update(hoodies, ['available_sizes', 'stock_quantity'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hoodieHub', '0005_hoodie_active_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HoodieVariant',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('size', models.CharField(choices=[('S', 'Small'), ('M', 'Medium'), ('L', 'Large'), ('XL', 'Extra Large')], max_length=5)),
+                ('stock', models.PositiveIntegerField(default=0)),
+                ('hoodie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='hoodieHub.hoodie')),
+            ],
+            options={
+                'unique_together': {('hoodie', 'size')},
+            },
+        ),
+        migrations.RunPython(split_sizes_into_variants, join_variants_into_sizes),
+    ]
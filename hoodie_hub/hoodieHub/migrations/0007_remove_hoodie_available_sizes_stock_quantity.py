@@ -0,0 +1,21 @@
+# Generated by Django 6.0.1 on 2026-10-17 22:47
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hoodieHub', '0006_hoodievariant'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='hoodie',
+            name='available_sizes',
+        ),
+        migrations.RemoveField(
+            model_name='hoodie',
+            name='stock_quantity',
+        ),
+    ]
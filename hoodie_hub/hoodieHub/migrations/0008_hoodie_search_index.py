@@ -0,0 +1,55 @@
+# Generated by Django 6.0.1 on 2026-10-17 23:05
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    """Create the full-text table for this database and fill it"""
+    Hoodie = apps.get_model('hoodieHub', 'Hoodie')
+    connection = schema_editor.connection
+    
+    if connection.vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS "hoodieHub_hoodie_fts" USING fts5('
+            "hoodie_id UNINDEXED, name, description, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4')"
+        )
+        for hoodie in Hoodie.objects.only('id', 'name', 'description').iterator():
+            schema_editor.execute(
+                'INSERT INTO "hoodieHub_hoodie_fts" (rowid, hoodie_id, name, description) VALUES (%s, %s, %s, %s)',
+                [hoodie.id.int & ((1 << 63) - 1), hoodie.id.hex, hoodie.name, hoodie.description]
+            )
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE TABLE IF NOT EXISTS "hoodieHub_hoodie_search" ('
+            '"hoodie_id" uuid PRIMARY KEY REFERENCES "hoodieHub_hoodie" ("id") ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+            '"document" tsvector NOT NULL)'
+        )
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS "hoodie_search_document_idx" ON "hoodieHub_hoodie_search" USING GIN ("document")'
+        )
+        schema_editor.execute(
+            'INSERT INTO "hoodieHub_hoodie_search" ("hoodie_id", "document") '
+            "SELECT id, setweight(to_tsvector('simple', name), 'A') || setweight(to_tsvector('simple', description), 'B') "
+            'FROM "hoodieHub_hoodie" ON CONFLICT DO NOTHING'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    
+    if connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS "hoodieHub_hoodie_fts"')
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute('DROP TABLE IF EXISTS "hoodieHub_hoodie_search"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hoodieHub', '0007_remove_hoodie_available_sizes_stock_quantity'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-17 23:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hoodieHub', '0008_hoodie_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hoodie',
+            name='image_digest',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 6.0.1 on 2026-10-17 23:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hoodieHub', '0009_hoodie_image_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hoodie',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0.1 on 2026-10-18 00:05
+
+from django.db import migrations, models
+
+
+def blank_to_null(apps, schema_editor):
+    # Orders whose push was never accepted all share '', which a unique
+    # index would reject; they have no CheckoutRequestID, so store NULL
+    Order = apps.get_model('hoodieHub', 'Order')
+    Order.objects.filter(checkout_request_id='').update(checkout_request_id=None)
+
+
+def null_to_blank(apps, schema_editor):
+    Order = apps.get_model('hoodieHub', 'Order')
+    Order.objects.filter(checkout_request_id__isnull=True).update(checkout_request_id='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hoodieHub', '0012_cart_updated_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='checkout_request_id',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.RunPython(blank_to_null, null_to_blank),
+        migrations.AlterField(
+            model_name='order',
+            name='checkout_request_id',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+    ]
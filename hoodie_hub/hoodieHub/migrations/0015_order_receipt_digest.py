@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 00:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hoodieHub', '0014_order_status_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='receipt_digest',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
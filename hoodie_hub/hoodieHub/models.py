@@ -32,19 +32,51 @@ class Hoodie(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     image_url = models.URLField(blank=True)
     image = models.ImageField(upload_to='hoodies/', blank=True, null=True)
-    available_sizes = models.CharField(max_length=50, default='S,M,L,XL') 
-    stock_quantity = models.IntegerField(default=0)
+    image_digest = models.CharField(max_length=64, blank=True, editable=False)  # Set once resized derivatives exist
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)  # Content version for caching and conditional GETs
     is_active = models.BooleanField(default=True)
     
     def __str__(self):
         return self.name
     
+    def get_variants(self):
+        """Size variants in S-XL order (uses prefetched variants when available)"""
+        size_order = [code for code, label in self.SIZE_CHOICES]
+        return sorted(
+            self.variants.all(),
+            key=lambda variant: size_order.index(variant.size) if variant.size in size_order else len(size_order)
+        )
+    
     def get_sizes_list(self):
-        return [size.strip() for size in self.available_sizes.split(',')]
+        return [variant.size for variant in self.get_variants()]
+    
+    @property
+    def stock_quantity(self):
+        """Total stock across all sizes"""
+        return sum(variant.stock for variant in self.variants.all())
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Matches the storefront's keyset pagination over active hoodies
+            models.Index(fields=['is_active', 'created_at', 'id'], name='hoodie_active_created_idx'),
+        ]
+
+
+class HoodieVariant(models.Model):
+    """Stock for a single size of a hoodie"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    hoodie = models.ForeignKey(Hoodie, on_delete=models.CASCADE, related_name='variants')
+    size = models.CharField(max_length=5, choices=Hoodie.SIZE_CHOICES)
+    stock = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.hoodie.name} ({self.size})"
+    
+    class Meta:
+        # Also serves as the index for per-size stock lookups
+        unique_together = ['hoodie', 'size']
 
 
 class Cart(models.Model):
@@ -60,10 +92,18 @@ class Cart(models.Model):
         return f"Cart {self.session_key}"
     
     def get_total(self):
-        return sum(item.get_subtotal() for item in self.items.all())
+        from .cart import CartSummary
+        return CartSummary.totals(self).total
     
     def get_item_count(self):
-        return sum(item.quantity for item in self.items.all())
+        from .cart import CartSummary
+        return CartSummary.totals(self).item_count
+    
+    class Meta:
+        indexes = [
+            # Lets purge_stale_carts find abandoned guest carts by age
+            models.Index(fields=['updated_at'], name='cart_updated_idx'),
+        ]
 
 
 class CartItem(models.Model):
@@ -102,9 +142,11 @@ class Order(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
     
     # M-Pesa fields
-    checkout_request_id = models.CharField(max_length=100, blank=True)
+    # Unique (and so indexed) for callback lookups; NULL until the push is accepted
+    checkout_request_id = models.CharField(max_length=100, unique=True, null=True, blank=True)
     merchant_request_id = models.CharField(max_length=100, blank=True)
     mpesa_receipt_number = models.CharField(max_length=100, blank=True)
+    receipt_digest = models.CharField(max_length=64, blank=True, editable=False)  # Set once the receipt PDF is stored
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -114,6 +156,10 @@ class Order(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # The reconciler looks for orders left PENDING past a cutoff
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+        ]
 
 
 class OrderItem(models.Model):
@@ -132,3 +178,38 @@ class OrderItem(models.Model):
         if self.price is None or self.quantity is None:
             return 0
         return self.price * self.quantity
+
+
+class StockReservation(models.Model):
+    """A hold on variant stock for a cart or an order awaiting payment.
+
+    Held units are already taken off HoodieVariant.stock, so ``stock`` is
+    always what is free to sell. Holds are confirmed when the order is paid,
+    or released (and the units put back) when they expire or the order fails.
+    """
+    HELD = 'HELD'
+    CONFIRMED = 'CONFIRMED'
+    RELEASED = 'RELEASED'
+    STATUS_CHOICES = [
+        (HELD, 'Held'),
+        (CONFIRMED, 'Confirmed'),
+        (RELEASED, 'Released'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    variant = models.ForeignKey(HoodieVariant, on_delete=models.CASCADE, related_name='reservations')
+    holder = models.CharField(max_length=64, db_index=True)  # The cart (or order) the units are held for
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, related_name='reservations', null=True, blank=True)
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=HELD)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.quantity}x {self.variant_id} for {self.holder} ({self.status})"
+    
+    class Meta:
+        indexes = [
+            # Lets the sweeper find expired holds without scanning the table
+            models.Index(fields=['status', 'expires_at'], name='reservation_status_expiry_idx'),
+        ]
@@ -0,0 +1,123 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from payments.callbacks import settle_each
+
+from .models import Order, OrderItem
+from .receipts import store_paid_receipt
+from .reservations import attach_to_order, confirm_order, release_order, reserve_items
+from .status_hub import publish_order_status
+
+
+class CheckoutError(Exception):
+    pass
+
+
+def create_order_from_cart(storage, user=None, **details):
+    """Turn the cart in ``storage`` into a PENDING order, all or nothing.
+
+    The cart is read once with its hoodies, names and prices are copied
+    from that snapshot, the order items go in with one bulk_create and the
+    total is summed from the same snapshot, so the order always matches the
+    lines it was built from. Raises CheckoutError if the cart is empty or
+    any line can't be held.
+    """
+    with transaction.atomic():
+        summary = storage.get_summary()
+        if summary.is_empty():
+            raise CheckoutError('Your cart is empty')
+        
+        lines = [
+            (item.hoodie.name, item.size, item.quantity, item.hoodie.price)
+            for item in summary.items
+        ]
+        
+        # Hold stock for every line; lines that can't be held are reported
+        holder = storage.get_holder()
+        shortages = reserve_items(holder, summary.items)
+        if shortages:
+            raise CheckoutError(' '.join(shortages))
+        
+        order = Order.objects.create(
+            user=user,
+            total_amount=sum((price * quantity for _, _, quantity, price in lines), Decimal('0.00')),
+            status='PENDING',
+            **details
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, hoodie_name=name, size=size, quantity=quantity, price=price)
+            for name, size, quantity, price in lines
+        ])
+        
+        # The held stock now belongs to the order until it is paid or fails
+        attach_to_order(holder, order)
+    
+    return order
+
+
+def apply_stk_push_result(job, response):
+    """STK push result handler for checkout orders (see payments.jobs)"""
+    order = Order.objects.filter(id=job.target_id).first()
+    if order is None:
+        return
+    
+    if response.get('ResponseCode') == '0':
+        # Update order with M-Pesa details
+        order.checkout_request_id = response.get('CheckoutRequestID')
+        order.merchant_request_id = response.get('MerchantRequestID')
+        order.save(update_fields=['checkout_request_id', 'merchant_request_id', 'updated_at'])
+    else:
+        settle_order(order, paid=False)
+
+
+def settle_order(order, paid, receipt_number=''):
+    """Mark a PENDING order PAID or FAILED and settle its stock holds.
+
+    The status change is a conditional UPDATE, so whichever caller settles
+    the order first wins and a repeated or late result is a no-op.
+    Returns True if this call settled the order.
+    """
+    fields = {'status': 'PAID' if paid else 'FAILED', 'updated_at': timezone.now()}
+    if paid:
+        fields['mpesa_receipt_number'] = receipt_number
+    if not Order.objects.filter(pk=order.pk, status='PENDING').update(**fields):
+        if paid and receipt_number:
+            add_receipt_number(order, receipt_number)
+        return False
+    
+    order.status = fields['status']
+    if paid:
+        order.mpesa_receipt_number = receipt_number
+    # update() skips the post_save write-through, so publish here
+    transaction.on_commit(lambda: publish_order_status(order))
+    
+    if paid:
+        confirm_order(order)
+        # Render the receipt once, now, rather than on every download
+        transaction.on_commit(lambda: store_paid_receipt(order.pk))
+    else:
+        release_order(order)
+    return True
+
+
+def add_receipt_number(order, receipt_number):
+    """Fill in the receipt number of an order settled by an STK query, which has none"""
+    if Order.objects.filter(pk=order.pk, status__in=['PAID', 'FULFILLED'], mpesa_receipt_number='').update(
+        mpesa_receipt_number=receipt_number,
+        updated_at=timezone.now()
+    ):
+        order.mpesa_receipt_number = receipt_number
+        transaction.on_commit(lambda: publish_order_status(order))
+        # The stored receipt was rendered without it
+        transaction.on_commit(lambda: store_paid_receipt(order.pk))
+
+
+def apply_order_callbacks(callbacks):
+    """M-Pesa callback handler for checkout orders (see payments.callbacks)"""
+    settle_each(callbacks, Order, lambda order, callback: settle_order(
+        order,
+        callback.result_code == 0,
+        str(callback.metadata.get('MpesaReceiptNumber') or '')
+    ))
@@ -0,0 +1,85 @@
+"""Order receipt PDFs, rendered once and served as files.
+
+A receipt never changes once its order is PAID, so it is rendered when the
+order settles (after the commit, off the customer's request) and stored in
+the ``receipts`` storage under the SHA-256 of its bytes; the order keeps
+the digest. Downloads then only send the stored file, through the web
+server when RECEIPT_SENDFILE_HEADER is set, with the digest as a strong
+ETag. Orders paid before receipts were stored, or whose render failed,
+are rendered on their first download.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.http import FileResponse, HttpResponse
+from django.utils.http import content_disposition_header
+
+from payments.pdf_generator import OrderReceiptGenerator
+
+from .models import Order
+
+
+def receipt_name(digest):
+    """Storage name of a receipt in the receipts storage"""
+    return f'{digest[:2]}/{digest}.pdf'
+
+
+def store_receipt(order):
+    """Render ``order``'s receipt, store it if it isn't already, and return its digest"""
+    pdf = OrderReceiptGenerator(order).generate().getvalue()
+    digest = hashlib.sha256(pdf).hexdigest()
+
+    storage = storages['receipts']
+    name = receipt_name(digest)
+    if not storage.exists(name):
+        storage.save(name, ContentFile(pdf))
+
+    Order.objects.filter(pk=order.pk).update(receipt_digest=digest)
+    order.receipt_digest = digest
+    return digest
+
+
+def store_paid_receipt(order_id):
+    """store_receipt for a freshly PAID order (runs after the settling commit)"""
+    try:
+        order = Order.objects.prefetch_related('items').get(pk=order_id, status='PAID')
+        store_receipt(order)
+    except Order.DoesNotExist:
+        pass
+    except Exception as e:
+        # The first download renders it instead
+        print(f"Error storing receipt for order {order_id}: {e}")
+
+
+def get_receipt(order):
+    """Digest of the order's stored receipt, rendering it now if it is missing"""
+    digest = order.receipt_digest
+    if digest and storages['receipts'].exists(receipt_name(digest)):
+        return digest
+    return store_receipt(order)
+
+
+def receipt_response(digest, filename):
+    """Response sending a stored receipt as an attachment"""
+    name = receipt_name(digest)
+    header = settings.RECEIPT_SENDFILE_HEADER
+
+    if not header:
+        return FileResponse(
+            storages['receipts'].open(name, 'rb'),
+            as_attachment=True,
+            filename=filename,
+            content_type='application/pdf'
+        )
+
+    # The web server replaces the empty body with the file
+    response = HttpResponse(content_type='application/pdf')
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    if header == 'X-Accel-Redirect':
+        response[header] = f'{settings.RECEIPT_SENDFILE_URL.rstrip("/")}/{name}'
+    else:
+        # Needs a storage on the local filesystem
+        response[header] = storages['receipts'].path(name)
+    return response
@@ -0,0 +1,257 @@
+"""Short-lived stock holds.
+
+Every unit in a cart or in an order awaiting payment is taken off
+HoodieVariant.stock with a single guarded ``UPDATE ... SET stock = stock - n
+WHERE stock >= n``, so two buyers can never both get the last unit and no
+row is locked for longer than that statement. Each hold is recorded as a
+StockReservation that is confirmed when the order is paid, or released
+(putting the units back) when the order fails or the hold expires.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .catalog import rebuild_catalog, touch_hoodie
+from .models import HoodieVariant, StockReservation
+
+HELD = StockReservation.HELD
+CONFIRMED = StockReservation.CONFIRMED
+RELEASED = StockReservation.RELEASED
+
+logger = logging.getLogger(__name__)
+
+
+def order_holder(order):
+    return f'order:{order.pk}'
+
+
+def _take(variant_id, quantity):
+    """Atomically take ``quantity`` units off a variant's stock, or fail"""
+    return HoodieVariant.objects.filter(pk=variant_id, stock__gte=quantity).update(
+        stock=F('stock') - quantity
+    ) > 0
+
+
+def _put_back(variant_id, quantity):
+    HoodieVariant.objects.filter(pk=variant_id).update(stock=F('stock') + quantity)
+
+
+def _availability_changed(variant_ids):
+    """Refresh cached product pages for variants that sold out or came back.
+
+    Pages only show whether a size is in stock, never how many are left, so
+    other stock changes leave them (and their ETags) as they are.
+    """
+    hoodie_ids = set(
+        HoodieVariant.objects.filter(pk__in=variant_ids)
+        .values_list('hoodie_id', flat=True)
+    )
+
+    def refresh():
+        for hoodie_id in hoodie_ids:
+            touch_hoodie(hoodie_id)
+        rebuild_catalog()
+
+    transaction.on_commit(refresh)
+
+
+def adjust_stock(variant_id, change):
+    """Add ``change`` units to a variant's stock (remove them if negative), e.g. a delivery.
+
+    Guarded like a hold, so it never overwrites holds taken meanwhile.
+    Returns False, changing nothing, if there aren't enough units to remove.
+    """
+    with transaction.atomic():
+        if change > 0:
+            _put_back(variant_id, change)
+        elif change < 0 and not _take(variant_id, -change):
+            return False
+        if change:
+            _availability_changed([variant_id])
+    return True
+
+
+def set_held(holder, variant, quantity, ttl=None):
+    """Make ``holder`` hold exactly ``quantity`` units of ``variant``.
+
+    Only the difference from what is already held touches the stock.
+    Returns False (holding nothing new) when there isn't enough stock.
+    """
+    ttl = settings.RESERVATION_CART_TTL if ttl is None else ttl
+
+    with transaction.atomic():
+        holds = list(
+            StockReservation.objects.select_for_update()
+            .filter(holder=holder, variant_id=variant.pk, status=HELD)
+        )
+        change = quantity - sum(hold.quantity for hold in holds)
+
+        if change > 0:
+            if not _take(variant.pk, change):
+                return False
+        elif change < 0:
+            _put_back(variant.pk, -change)
+
+        if change:
+            # Sold out, or back from sold out
+            stock = HoodieVariant.objects.values_list('stock', flat=True).get(pk=variant.pk)
+            if stock == max(-change, 0):
+                _availability_changed([variant.pk])
+
+        # Collapse into a single hold with a fresh expiry
+        expires_at = timezone.now() + timedelta(seconds=ttl)
+        if holds:
+            keep, extra = holds[0], holds[1:]
+            if extra:
+                StockReservation.objects.filter(pk__in=[hold.pk for hold in extra]).update(status=RELEASED)
+            if quantity > 0:
+                StockReservation.objects.filter(pk=keep.pk).update(quantity=quantity, expires_at=expires_at)
+            else:
+                StockReservation.objects.filter(pk=keep.pk).update(status=RELEASED)
+        elif quantity > 0:
+            StockReservation.objects.create(
+                variant_id=variant.pk,
+                holder=holder,
+                quantity=quantity,
+                expires_at=expires_at
+            )
+
+    return True
+
+
+def reserve_items(holder, items):
+    """Hold stock for every cart line, returning a message for each that can't be held.
+
+    Lines whose hold is still in place cost nothing beyond the two reads
+    below; only lines that lost (or never had) a hold touch the stock.
+    """
+    variants = {
+        (variant.hoodie_id, variant.size): variant
+        for variant in HoodieVariant.objects.filter(hoodie_id__in={item.hoodie_id for item in items})
+    }
+    held = {}
+    for variant_id, quantity in (
+        StockReservation.objects.select_for_update()
+        .filter(holder=holder, status=HELD)
+        .values_list('variant_id', 'quantity')
+    ):
+        held[variant_id] = held.get(variant_id, 0) + quantity
+
+    shortages = []
+    for item in items:
+        variant = variants.get((item.hoodie_id, item.size))
+        if variant is None:
+            shortages.append(f'{item.hoodie.name} is no longer available in size {item.size}.')
+        elif held.get(variant.pk) == item.quantity:
+            continue
+        elif not set_held(holder, variant, item.quantity):
+            variant.refresh_from_db(fields=['stock'])
+            available = variant.stock + held_quantity(holder, variant)
+            shortages.append(f'Only {available} of {item.hoodie.name} ({item.size}) left in stock.')
+    return shortages
+
+
+def held_quantity(holder, variant):
+    return StockReservation.objects.filter(
+        holder=holder, variant_id=variant.pk, status=HELD
+    ).aggregate(quantity=Sum('quantity'))['quantity'] or 0
+
+
+def transfer_holds(old_holder, new_holder):
+    """Give every hold of one cart to another (e.g. when carts merge at login)"""
+    if old_holder and new_holder and old_holder != new_holder:
+        StockReservation.objects.filter(holder=old_holder, status=HELD).update(holder=new_holder)
+
+
+def attach_to_order(holder, order):
+    """Move a cart's holds onto an order for the length of the payment window"""
+    StockReservation.objects.filter(holder=holder, status=HELD).update(
+        holder=order_holder(order),
+        order=order,
+        expires_at=timezone.now() + timedelta(seconds=settings.RESERVATION_CHECKOUT_TTL)
+    )
+
+
+def release(reservations):
+    """Release held reservations from a queryset and put their units back.
+
+    Returns the number of units released.
+    """
+    with transaction.atomic():
+        holds = list(
+            reservations.select_for_update()
+            .filter(status=HELD)
+            .values_list('pk', 'variant_id', 'quantity')
+        )
+        if not holds:
+            return 0
+
+        StockReservation.objects.filter(pk__in=[pk for pk, _, _ in holds]).update(status=RELEASED)
+
+        per_variant = {}
+        for _, variant_id, quantity in holds:
+            per_variant[variant_id] = per_variant.get(variant_id, 0) + quantity
+
+        restocked = []
+        for variant_id, quantity in per_variant.items():
+            _put_back(variant_id, quantity)
+            restocked.append(variant_id)
+
+        # Only variants that were sold out change what the storefront shows
+        back_in_stock = HoodieVariant.objects.filter(
+            pk__in=restocked
+        ).values_list('pk', 'stock')
+        changed = [variant_id for variant_id, stock in back_in_stock if stock == per_variant[variant_id]]
+        if changed:
+            _availability_changed(changed)
+
+    return sum(per_variant.values())
+
+
+def release_line(holder, hoodie_id, size):
+    """Release a cart's hold on one (hoodie, size) line"""
+    return release(StockReservation.objects.filter(
+        holder=holder, variant__hoodie_id=hoodie_id, variant__size=size
+    ))
+
+
+def release_order(order):
+    return release(StockReservation.objects.filter(order=order))
+
+
+def confirm_order(order):
+    """Turn an order's holds into sales once it is paid.
+
+    If a hold already expired (e.g. a very late callback), its units are
+    taken again; a shortfall is logged rather than failing a paid order.
+    """
+    with transaction.atomic():
+        StockReservation.objects.filter(order=order, status=HELD).update(status=CONFIRMED)
+
+        expired = StockReservation.objects.select_for_update().filter(order=order, status=RELEASED)
+        for hold in expired:
+            if _take(hold.variant_id, hold.quantity):
+                StockReservation.objects.filter(pk=hold.pk).update(status=CONFIRMED)
+            else:
+                logger.warning(
+                    'Order %s was paid after its hold expired and variant %s has no stock left',
+                    order.pk, hold.variant_id
+                )
+
+
+def release_expired(batch_size=500):
+    """Release one batch of expired holds, returning how many were released"""
+    with transaction.atomic():
+        expired = list(
+            StockReservation.objects
+            .filter(status=HELD, expires_at__lt=timezone.now())
+            .order_by('expires_at')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if expired:
+            release(StockReservation.objects.filter(pk__in=expired))
+    return len(expired)
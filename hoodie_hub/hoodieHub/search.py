@@ -0,0 +1,148 @@
+"""Full-text product search.
+
+SQLite keeps an FTS5 table and Postgres a tsvector table with a GIN index,
+both created by migration 0008 and kept in sync from the Hoodie signals.
+Other databases fall back to a plain ``icontains`` filter.
+"""
+import re
+import uuid
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Hoodie
+
+SQLITE_TABLE = 'hoodieHub_hoodie_fts'
+POSTGRES_TABLE = 'hoodieHub_hoodie_search'
+
+# Cap the number of terms so a pasted paragraph can't build a huge query
+MAX_TERMS = 8
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def is_supported():
+    """Whether the current database has a full-text index"""
+    return connection.vendor in ('sqlite', 'postgresql')
+
+
+def _terms(query):
+    return TERM_RE.findall((query or '').lower())[:MAX_TERMS]
+
+
+def _sqlite_rowid(hoodie_id):
+    # FTS5 rows are addressed by integer rowid; fold the UUID into 63 bits
+    return uuid.UUID(str(hoodie_id)).int & ((1 << 63) - 1)
+
+
+def _hoodie_table():
+    return connection.ops.quote_name(Hoodie._meta.db_table)
+
+
+def index_hoodie(hoodie):
+    """Insert or refresh a hoodie's row in the search index"""
+    if connection.vendor == 'sqlite':
+        rowid = _sqlite_rowid(hoodie.id)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM "{SQLITE_TABLE}" WHERE rowid = %s', [rowid])
+            cursor.execute(
+                f'INSERT INTO "{SQLITE_TABLE}" (rowid, hoodie_id, name, description) VALUES (%s, %s, %s, %s)',
+                [rowid, uuid.UUID(str(hoodie.id)).hex, hoodie.name, hoodie.description]
+            )
+    elif connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'''INSERT INTO "{POSTGRES_TABLE}" (hoodie_id, document)
+                    VALUES (%s, setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'B'))
+                    ON CONFLICT (hoodie_id) DO UPDATE SET document = EXCLUDED.document''',
+                [hoodie.id, hoodie.name, hoodie.description]
+            )
+
+
+def remove_hoodie(hoodie_id):
+    """Drop a hoodie from the search index"""
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM "{SQLITE_TABLE}" WHERE rowid = %s', [_sqlite_rowid(hoodie_id)])
+    elif connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM "{POSTGRES_TABLE}" WHERE hoodie_id = %s', [hoodie_id])
+
+
+def rebuild_index(batch_size=500):
+    """Re-index every hoodie, returning how many were indexed"""
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM "{SQLITE_TABLE}"')
+    elif connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM "{POSTGRES_TABLE}"')
+    else:
+        return 0
+
+    count = 0
+    for hoodie in Hoodie.objects.only('id', 'name', 'description').iterator(chunk_size=batch_size):
+        index_hoodie(hoodie)
+        count += 1
+    return count
+
+
+def search_hoodie_ids(query, limit=50, active_only=True):
+    """Return hoodie ids matching ``query``, best match first.
+
+    Every term is matched as a prefix and all terms must match. Name hits
+    rank above description hits. Returns None when the database has no
+    full-text index so callers can fall back to their own filtering.
+    """
+    if not is_supported():
+        return None
+
+    terms = _terms(query)
+    if not terms:
+        return []
+
+    limit_sql = ' LIMIT %s' if limit else ''
+    active_sql = ' AND h.is_active' if active_only else ''
+
+    if connection.vendor == 'sqlite':
+        match = ' AND '.join(f'"{term}"*' for term in terms)
+        sql = (
+            f'SELECT f.hoodie_id FROM "{SQLITE_TABLE}" f '
+            f'JOIN {_hoodie_table()} h ON h.id = f.hoodie_id '
+            f'WHERE "{SQLITE_TABLE}" MATCH %s{active_sql} '
+            f'ORDER BY bm25("{SQLITE_TABLE}", 0.0, 10.0, 1.0){limit_sql}'
+        )
+        params = [match]
+    else:
+        tsquery = ' & '.join(f"'{term}':*" for term in terms)
+        sql = (
+            f'SELECT s.hoodie_id FROM "{POSTGRES_TABLE}" s '
+            f'JOIN {_hoodie_table()} h ON h.id = s.hoodie_id '
+            f"WHERE s.document @@ to_tsquery('simple', %s){active_sql} "
+            f"ORDER BY ts_rank(s.document, to_tsquery('simple', %s)) DESC{limit_sql}"
+        )
+        params = [tsquery, tsquery]
+
+    if limit:
+        params.append(limit)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [uuid.UUID(str(row[0])) for row in cursor.fetchall()]
+
+
+def search_hoodies(query, limit=50):
+    """Active hoodies matching ``query`` in rank order"""
+    ids = search_hoodie_ids(query, limit=limit)
+    hoodies = Hoodie.objects.filter(is_active=True).prefetch_related('variants')
+
+    if ids is None:
+        terms = _terms(query)
+        if not terms:
+            return []
+        condition = Q()
+        for term in terms:
+            condition &= Q(name__icontains=term) | Q(description__icontains=term)
+        return list(hoodies.filter(condition)[:limit])
+
+    found = hoodies.in_bulk(ids)
+    return [found[hoodie_id] for hoodie_id in ids if hoodie_id in found]
@@ -1,7 +1,12 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import UserProfile
+from .models import UserProfile, Hoodie, HoodieVariant, Order
+from .catalog import rebuild_catalog, set_hoodie_modified, forget_hoodie, touch_hoodie
+from . import search
+from .images import schedule_derivatives
+from .status_hub import publish_order_status
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -15,3 +20,76 @@ def save_user_profile(sender, instance, **kwargs):
     # Only save if profile exists
     if hasattr(instance, 'profile'):
         instance.profile.save()
+
+@receiver(post_save, sender=Hoodie)
+@receiver(post_delete, sender=Hoodie)
+@receiver(post_save, sender=HoodieVariant)
+@receiver(post_delete, sender=HoodieVariant)
+def invalidate_catalog(sender, instance, **kwargs):
+    """Rebuild the cached catalog once the change is committed"""
+    # Waiting for the commit keeps other workers from caching pre-commit rows
+    transaction.on_commit(rebuild_catalog)
+
+
+@receiver(post_save, sender=Hoodie)
+def update_search_index(sender, instance, **kwargs):
+    """Keep the full-text index in step with the hoodie"""
+    search.index_hoodie(instance)
+
+@receiver(post_delete, sender=Hoodie)
+def remove_from_search_index(sender, instance, **kwargs):
+    """Drop a deleted hoodie from the full-text index"""
+    search.remove_hoodie(instance.id)
+
+
+@receiver(pre_save, sender=Hoodie)
+def reset_image_digest(sender, instance, update_fields=None, raw=False, **kwargs):
+    """Forget the old image's derivatives as soon as the image is replaced"""
+    instance._image_changed = False
+    if raw or (update_fields is not None and 'image' not in update_fields):
+        return
+
+    new_name = instance.image.name or ''
+    if instance._state.adding:
+        old_name = ''
+    else:
+        old_name = Hoodie.objects.filter(pk=instance.pk).values_list('image', flat=True).first() or ''
+    if new_name == old_name:
+        return
+
+    instance._image_changed = True
+    # Until the new derivatives exist, pages fall back to the new upload
+    # rather than serving the previous image's renditions
+    instance.image_digest = ''
+    if update_fields is not None and 'image_digest' not in update_fields:
+        Hoodie.objects.filter(pk=instance.pk).update(image_digest='')
+
+@receiver(post_save, sender=Hoodie)
+def build_image_derivatives(sender, instance, **kwargs):
+    """Resize a new or replaced image in the background once the save commits"""
+    if not instance.image or not getattr(instance, '_image_changed', False):
+        return
+    transaction.on_commit(lambda: schedule_derivatives(instance))
+
+
+@receiver(post_save, sender=Hoodie)
+def update_hoodie_modified(sender, instance, **kwargs):
+    """Write the new content version through to the cache after commit"""
+    transaction.on_commit(lambda: set_hoodie_modified(instance.id, instance.updated_at))
+
+@receiver(post_delete, sender=Hoodie)
+def forget_hoodie_modified(sender, instance, **kwargs):
+    transaction.on_commit(lambda: forget_hoodie(instance.id))
+
+@receiver(post_save, sender=HoodieVariant)
+@receiver(post_delete, sender=HoodieVariant)
+def touch_variant_hoodie(sender, instance, **kwargs):
+    """Stock changes show on the product page, so they change its version"""
+    hoodie_id = instance.hoodie_id
+    transaction.on_commit(lambda: touch_hoodie(hoodie_id))
+
+
+@receiver(post_save, sender=Order)
+def update_order_status(sender, instance, **kwargs):
+    """Write the order's status projection through to the cache after commit"""
+    transaction.on_commit(lambda: publish_order_status(instance))
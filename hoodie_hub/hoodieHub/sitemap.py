@@ -0,0 +1,130 @@
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import reverse
+
+from .catalog import get_catalog_version
+from .models import Hoodie
+
+SITEMAP_KEY = 'hoodieHub:sitemap:{version}:{domain}:{section}'
+SHARD_COUNT_KEY = 'hoodieHub:sitemap:{version}:shards'
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+URLSET_OPEN = (
+    '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" '
+    'xmlns:image="http://www.google.com/schemas/sitemap-image/1.1">\n'
+)
+
+
+def _cache_key(domain, section):
+    return SITEMAP_KEY.format(version=get_catalog_version(), domain=domain, section=section)
+
+
+def get_cached_section(domain, section):
+    return cache.get(_cache_key(domain, section))
+
+
+def cache_section(domain, section, xml):
+    cache.set(_cache_key(domain, section), xml, settings.CATALOG_CACHE_TIMEOUT)
+
+
+def cache_while_streaming(chunks, domain, section):
+    """Pass chunks through and cache the full document once it is complete.
+
+    If the client disconnects early the generator is closed before the end,
+    so a partial document is never cached.
+    """
+    # Key on the version seen before reading rows, so a catalog change
+    # mid-stream can't file old content under the new version
+    key = _cache_key(domain, section)
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    cache.set(key, ''.join(parts), settings.CATALOG_CACHE_TIMEOUT)
+
+
+def product_shard_count():
+    """Number of fixed-size product shards for the current catalog version"""
+    key = SHARD_COUNT_KEY.format(version=get_catalog_version())
+    shards = cache.get(key)
+    if shards is None:
+        count = Hoodie.objects.filter(is_active=True).count()
+        shards = max(1, -(-count // settings.SITEMAP_SHARD_SIZE))
+        cache.set(key, shards, settings.CATALOG_CACHE_TIMEOUT)
+    return shards
+
+
+def render_index(domain):
+    """Sitemap index pointing at the static pages and every product shard"""
+    locations = [reverse('hoodieHub:sitemap_pages')]
+    locations += [
+        reverse('hoodieHub:sitemap_products', args=[shard])
+        for shard in range(1, product_shard_count() + 1)
+    ]
+
+    xml = XML_HEADER
+    xml += '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    for location in locations:
+        xml += f'  <sitemap>\n    <loc>{escape(domain + location)}</loc>\n  </sitemap>\n'
+    xml += '</sitemapindex>'
+    return xml
+
+
+def generate_pages(domain):
+    yield XML_HEADER + URLSET_OPEN
+
+    # Static pages with high priority
+    static_urls = [
+        (reverse('hoodieHub:home'), '1.0', 'weekly'),
+        (reverse('hoodieHub:view_cart'), '0.8', 'weekly'),
+    ]
+    for url, priority, changefreq in static_urls:
+        yield (
+            f'  <url>\n'
+            f'    <loc>{escape(domain + url)}</loc>\n'
+            f'    <priority>{priority}</priority>\n'
+            f'    <changefreq>{changefreq}</changefreq>\n'
+            f'  </url>\n'
+        )
+
+    yield '</urlset>'
+
+
+def generate_products(domain, shard):
+    """Yield the <urlset> for one shard of active hoodies, a row at a time"""
+    size = settings.SITEMAP_SHARD_SIZE
+    start = (shard - 1) * size
+    # Oldest first, so adding hoodies only ever changes the last shard
+    hoodies = (
+        Hoodie.objects
+        .filter(is_active=True)
+        .order_by('created_at', 'id')
+        .only('id', 'name', 'image', 'updated_at')
+    )[start:start + size]
+
+    yield XML_HEADER + URLSET_OPEN
+
+    for hoodie in hoodies.iterator(chunk_size=500):
+        url = reverse('hoodieHub:hoodie_detail', args=[hoodie.id])
+        chunk = (
+            f'  <url>\n'
+            f'    <loc>{escape(domain + url)}</loc>\n'
+            f'    <lastmod>{hoodie.updated_at.date().isoformat()}</lastmod>\n'
+            f'    <priority>0.9</priority>\n'
+            f'    <changefreq>monthly</changefreq>\n'
+        )
+
+        # Add image if available
+        if hoodie.image:
+            chunk += (
+                f'    <image:image>\n'
+                f'      <image:loc>{escape(domain + hoodie.image.url)}</image:loc>\n'
+                f'      <image:title>{escape(hoodie.name)}</image:title>\n'
+                f'    </image:image>\n'
+            )
+
+        yield chunk + '  </url>\n'
+
+    yield '</urlset>'
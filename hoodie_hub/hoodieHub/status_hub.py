@@ -0,0 +1,151 @@
+"""Cached order status, and pushing its changes to open confirmation pages.
+
+Each order has a small status projection in the cache, written through
+whenever the order is saved or settled, so status reads normally never
+touch the database; ids that don't exist are cached briefly as well.
+
+Each web process runs one hub per event loop that holds every waiting
+connection and, while any are waiting, reads all of their projections
+with a single ``get_many`` every ORDER_STATUS_POLL_INTERVAL seconds. So
+however many customers are watching, a process makes one cache read per
+interval and no database reads. Changes published in the same process
+wake waiters straight away.
+
+Orders are settled by the callback and reconcile commands in their own
+processes, so projections are only cached when the cache is shared
+between processes (e.g. Redis or Memcached; see
+payments.status.status_cache_enabled). With a per-process cache, status
+reads and the hub's poll go to the database instead: still one query per
+interval for all of a hub's waiters.
+"""
+import asyncio
+import threading
+import weakref
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+
+from payments.status import status_cache_enabled
+
+from .models import Order
+
+STATUS_KEY = 'hoodieHub:order-status:{order_id}'
+
+_hubs = weakref.WeakKeyDictionary()
+_hubs_lock = threading.Lock()
+
+
+def order_state(status, mpesa_receipt_number, total_amount):
+    return {
+        'status': status,
+        'mpesa_receipt': mpesa_receipt_number or '',
+        'amount': str(Decimal(total_amount).quantize(Decimal('0.01')))
+    }
+
+
+def publish_order_status(order):
+    """Write an order's status through to the cache and wake anyone waiting on it"""
+    state = order_state(order.status, order.mpesa_receipt_number, order.total_amount)
+    if status_cache_enabled():
+        cache.set(STATUS_KEY.format(order_id=order.pk), state, settings.ORDER_STATUS_CACHE_TIMEOUT)
+
+    with _hubs_lock:
+        hubs = list(_hubs.values())
+    for hub in hubs:
+        try:
+            hub.loop.call_soon_threadsafe(hub.notify, str(order.pk), state)
+        except RuntimeError:
+            # That loop has closed
+            pass
+
+
+async def aget_order_status(order_id):
+    """An order's cached status, read from the database only on a miss.
+
+    Returns None if there is no such order.
+    """
+    cached = status_cache_enabled()
+    key = STATUS_KEY.format(order_id=order_id)
+    state = await cache.aget(key) if cached else None
+    if state is None:
+        row = await Order.objects.filter(id=order_id).values_list(
+            'status', 'mpesa_receipt_number', 'total_amount'
+        ).afirst()
+        state = order_state(*row) if row else False
+        if cached:
+            # add(), not set(): a settle published since the read above must win.
+            # Misses are remembered too, but not for long
+            timeout = settings.ORDER_STATUS_CACHE_TIMEOUT if row else settings.STATUS_MISSING_CACHE_TIMEOUT
+            await cache.aadd(key, state, timeout)
+    return state or None
+
+
+async def aget_order_states(order_ids):
+    """Current states of several orders, keyed by id; ids with no state are left out"""
+    if status_cache_enabled():
+        keys = {STATUS_KEY.format(order_id=order_id): order_id for order_id in order_ids}
+        states = await cache.aget_many(keys)
+        return {keys[key]: state for key, state in states.items() if state}
+
+    rows = Order.objects.filter(id__in=order_ids).values_list(
+        'id', 'status', 'mpesa_receipt_number', 'total_amount'
+    )
+    return {str(order_id): order_state(*row) async for order_id, *row in rows}
+
+
+def get_hub():
+    loop = asyncio.get_running_loop()
+    with _hubs_lock:
+        hub = _hubs.get(loop)
+        if hub is None:
+            hub = _hubs[loop] = StatusHub(loop)
+    return hub
+
+
+class StatusHub:
+    """Order status waiters for one event loop"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.waiters = {}  # order id -> {future: status the waiter last saw}
+        self.poller = None
+
+    async def wait(self, order_id, known_status, timeout):
+        """Wait up to ``timeout`` seconds for the order to leave ``known_status``.
+
+        Returns the order's new state, or None on timeout.
+        """
+        order_id = str(order_id)
+        future = self.loop.create_future()
+        self.waiters.setdefault(order_id, {})[future] = known_status
+        if self.poller is None or self.poller.done():
+            self.poller = self.loop.create_task(self.poll())
+
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            waiting = self.waiters.get(order_id)
+            if waiting is not None:
+                waiting.pop(future, None)
+                if not waiting:
+                    del self.waiters[order_id]
+
+    def notify(self, order_id, state):
+        for future, known_status in list(self.waiters.get(order_id, {}).items()):
+            if state['status'] != known_status and not future.done():
+                future.set_result(state)
+
+    async def poll(self):
+        """Check for changes made by other processes while anyone waits"""
+        while self.waiters:
+            await asyncio.sleep(settings.ORDER_STATUS_POLL_INTERVAL)
+            try:
+                states = await aget_order_states(list(self.waiters))
+            except Exception as e:
+                print(f"Error reading order statuses: {e}")
+                continue
+            for order_id, state in states.items():
+                self.notify(order_id, state)
@@ -0,0 +1,50 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from hoodieHub.images import RENDITIONS, derivative_urls
+
+register = template.Library()
+
+# How wide each rendition is drawn, so the browser can pick from srcset
+RENDITION_SIZES = {
+    'thumbnail': '160px',
+    'card': '(min-width: 1024px) 384px, (min-width: 640px) 50vw, 100vw',
+    'detail': '(min-width: 1024px) 480px, (min-width: 768px) 50vw, 100vw',
+}
+
+
+def _srcset(urls):
+    return format_html_join(', ', '{} {}w', urls)
+
+
+@register.simple_tag
+def hoodie_image(hoodie, rendition='card', alt='', css_class='', loading='lazy'):
+    """Responsive <picture> for a hoodie image with WebP and JPEG srcsets.
+
+    Falls back to the original upload until its derivatives have been built.
+    """
+    if not hoodie.image:
+        return ''
+    
+    webp_urls = derivative_urls(hoodie, 'webp')
+    jpeg_urls = derivative_urls(hoodie, 'jpg')
+    if not webp_urls or not jpeg_urls:
+        return format_html(
+            '<img src="{}" alt="{}" title="{}" class="{}" loading="{}">',
+            hoodie.image.url, alt, hoodie.name, css_class, loading
+        )
+    
+    # Default src is the JPEG closest to the rendition's nominal width
+    width = RENDITIONS[rendition]
+    src = next((url for url, url_width in jpeg_urls if url_width >= width), jpeg_urls[-1][0])
+    sizes = RENDITION_SIZES[rendition]
+    
+    return format_html(
+        # display: contents lets the <img> size against the card like a bare <img>
+        '<picture style="display: contents">'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" title="{}" class="{}" loading="{}" decoding="async">'
+        '</picture>',
+        _srcset(webp_urls), sizes,
+        src, _srcset(jpeg_urls), sizes, alt, hoodie.name, css_class, loading
+    )
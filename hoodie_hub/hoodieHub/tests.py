@@ -1,3 +1,17 @@
 from django.test import TestCase
 
-# Create your tests here.
+from .cart import CartSummary
+from .models import Cart, CartItem, Hoodie
+
+
+class CartSummaryTests(TestCase):
+    def test_amounts_have_two_decimal_places(self):
+        hoodie = Hoodie.objects.create(name='Classic', description='Warm', price=100)
+        cart = Cart.objects.create(session_key='test-session')
+        CartItem.objects.create(cart=cart, hoodie=hoodie, size='M', quantity=2)
+
+        summary = CartSummary.for_cart(cart).as_dict()
+
+        self.assertEqual(summary['items'][0]['subtotal'], '200.00')
+        self.assertEqual(summary['total'], '200.00')
+        self.assertEqual(str(CartSummary.totals(cart).total), '200.00')
@@ -6,6 +6,8 @@ app_name = 'hoodieHub'
 urlpatterns = [
     # SEO
     path('sitemap.xml', views.sitemap, name='sitemap'),
+    path('sitemap-pages.xml', views.sitemap_pages, name='sitemap_pages'),
+    path('sitemap-products-<int:shard>.xml', views.sitemap_products, name='sitemap_products'),
     
     # Authentication
     path('register/', views.register, name='register'),
@@ -16,6 +18,7 @@ urlpatterns = [
     # Product pages
     path('', views.home, name='home'),
     path('hoodie/<uuid:hoodie_id>/', views.hoodie_detail, name='hoodie_detail'),
+    path('search/', views.search, name='search'),
     
     # Cart
     path('cart/', views.view_cart, name='view_cart'),
@@ -34,8 +37,10 @@ urlpatterns = [
     path('order/<uuid:order_id>/', views.order_confirmation, name='order_confirmation'),
     path('order/<uuid:order_id>/detail/', views.order_detail, name='order_detail'),
     path('order/<uuid:order_id>/status/', views.check_order_status, name='check_order_status'),
+    path('order/<uuid:order_id>/status/stream/', views.order_status_stream, name='order_status_stream'),
     path('order/<uuid:order_id>/receipt/', views.download_receipt, name='download_receipt'),
     
     # Cart Data
     path('cart/data/', views.get_cart_data, name='get_cart_data'),
+    path('cart/batch/', views.cart_batch, name='cart_batch'),
 ]
\ No newline at end of file
@@ -1,16 +1,37 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, Http404, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import require_http_methods, condition
+from django.views.decorators.cache import cache_control
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
-from django.urls import reverse
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
+from django.conf import settings
+from asgiref.sync import sync_to_async
+import asyncio
+import hashlib
 import json
-from .models import Hoodie, Cart, CartItem, Order, OrderItem, UserProfile
-from  payments.mpesa import MpesaService
-from payments.pdf_generator import OrderReceiptGenerator
+from .models import Hoodie, HoodieVariant, Cart, Order, UserProfile
+from .cart import CartBatchError, CartFull, get_cart_storage
+from .catalog import get_catalog_page, get_hoodie_modified, InvalidCursor
+from .inventory import get_variant
+from .orders import CheckoutError, create_order_from_cart
+from .reservations import (
+    held_quantity, release_line, release_order, set_held
+)
+from .receipts import get_receipt, receipt_response
+from .search import search_hoodies
+from .status_hub import aget_order_status, get_hub
+from .sitemap import (
+    cache_section, cache_while_streaming, generate_pages, generate_products, get_cached_section,
+    product_shard_count, render_index
+)
+from payments.breaker import UNAVAILABLE_MESSAGE, is_unavailable
+from payments.callbacks import record_callback
+from payments.jobs import create_stk_push_job, send_inline
+from payments.models import StkPushJob
+from payments.mpesa import MpesaService
 import uuid
 
 # ========== AUTHENTICATION VIEWS ==========
@@ -92,33 +113,12 @@ def login_view(request):
         user = authenticate(request, username=username, password=password)
         
         if user is not None:
+            # The guest cart has to be looked up before login() changes who the visitor is
+            guest_storage = get_cart_storage(request)
             login(request, user)
             
-            # Merge session cart with user cart if exists
-            if 'cart_session' in request.session:
-                old_session_key = request.session['cart_session']
-                try:
-                    old_cart = Cart.objects.get(session_key=old_session_key)
-                    # Get or create user cart
-                    user_cart, created = Cart.objects.get_or_create(user=user)
-                    # Move items to user cart
-                    for item in old_cart.items.all():
-                        existing_item = CartItem.objects.filter(
-                            cart=user_cart,
-                            hoodie=item.hoodie,
-                            size=item.size
-                        ).first()
-                        if existing_item:
-                            existing_item.quantity += item.quantity
-                            existing_item.save()
-                        else:
-                            item.cart = user_cart
-                            item.save()
-                    # Delete old session cart
-                    old_cart.delete()
-                except Cart.DoesNotExist:
-                    pass
-                del request.session['cart_session']
+            # Merge guest cart with user cart
+            guest_storage.merge_into(user)
             
             # Redirect to home after successful login
             return redirect('hoodieHub:home')
@@ -132,23 +132,17 @@ def login_view(request):
 
 def logout_view(request):
     """User logout"""
-    # Convert user cart to session cart if user is logged in
+    user_cart = None
     if request.user.is_authenticated:
-        try:
-            user_cart = Cart.objects.get(user=request.user)
-            # Create new session cart
-            request.session['cart_session'] = str(uuid.uuid4())
-            session_cart = Cart.objects.create(session_key=request.session['cart_session'])
-            # Move items to session cart
-            for item in user_cart.items.all():
-                item.cart = session_cart
-                item.save()
-            # Delete user cart
-            user_cart.delete()
-        except Cart.DoesNotExist:
-            request.session['cart_session'] = str(uuid.uuid4())
+        user_cart = Cart.objects.filter(user=request.user).first()
     
     logout(request)
+    
+    # Hand the user cart over to the fresh guest session; logout() flushes
+    # the session, so this has to happen afterwards
+    if user_cart is not None:
+        get_cart_storage(request, refresh=True).take_over(user_cart)
+    
     return redirect('hoodieHub:home')
 
 
@@ -168,6 +162,7 @@ def order_detail(request, order_id):
         if action == 'cancel' and order.status == 'PENDING':
             order.status = 'CANCELLED'
             order.save()
+            release_order(order)
             return render(request, 'hoodieHub/order_detail.html', {
                 'order': order,
                 'success': 'Order has been cancelled successfully'
@@ -220,49 +215,62 @@ def user_profile(request):
 
 def home(request):
     """Homepage - List all hoodies"""
-    hoodies = Hoodie.objects.filter(is_active=True)
+    cursor = request.GET.get('after', '')
     
-    # Get cart count for display
-    cart_count = 0
-    if 'cart_session' in request.session:
-        try:
-            cart = Cart.objects.get(session_key=request.session['cart_session'])
-            cart_count = cart.get_item_count()
-        except Cart.DoesNotExist:
-            pass
+    # Served from the versioned catalog cache; the cart badge loads via AJAX
+    try:
+        catalog_version, page = get_catalog_page(cursor)
+    except InvalidCursor:
+        raise Http404('Invalid page')
     
     return render(request, 'hoodieHub/home.html', {
-        'hoodies': hoodies,
-        'cart_count': cart_count
+        'hoodies': page['hoodies'],
+        'next_cursor': page['next_cursor'],
+        'cursor': cursor,
+        'catalog_version': catalog_version,
+        'catalog_cache_timeout': settings.CATALOG_CACHE_TIMEOUT
     })
 
+def hoodie_detail_etag(request, hoodie_id):
+    """ETag for a product page, or None if the hoodie doesn't exist"""
+    modified = get_hoodie_modified(hoodie_id)
+    if modified is None:
+        return None
+    # The page also embeds the visitor's name and CSRF token
+    user_id = request.user.pk if request.user.is_authenticated else ''
+    csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+    raw = f'{hoodie_id}|{modified.isoformat()}|{user_id}|{csrf_cookie}'
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+def hoodie_detail_last_modified(request, hoodie_id):
+    return get_hoodie_modified(hoodie_id)
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=hoodie_detail_etag, last_modified_func=hoodie_detail_last_modified)
 def hoodie_detail(request, hoodie_id):
     """Single hoodie detail page"""
-    hoodie = get_object_or_404(Hoodie, id=hoodie_id)
-    sizes = hoodie.get_sizes_list()
+    hoodie = get_object_or_404(Hoodie.objects.prefetch_related('variants'), id=hoodie_id)
+    variants = hoodie.get_variants()
     
     return render(request, 'hoodieHub/hoodie_detail.html', {
         'hoodie': hoodie,
-        'sizes': sizes
+        'variants': variants,
+        # Rendered product fragments are cached per hoodie and content version
+        'content_version': hoodie.updated_at.isoformat(),
+        'fragment_cache_timeout': settings.CATALOG_CACHE_TIMEOUT
     })
 
-# ========== CART VIEWS ==========
-
-def get_or_create_cart(request):
-    """Get or create cart for current session or user"""
-    if request.user.is_authenticated:
-        # For authenticated users, use user-based cart
-        cart, created = Cart.objects.get_or_create(user=request.user)
-    else:
-        # For anonymous users, use session-based cart
-        if 'cart_session' not in request.session:
-            request.session['cart_session'] = str(uuid.uuid4())
-        
-        cart, created = Cart.objects.get_or_create(
-            session_key=request.session['cart_session']
-        )
+def search(request):
+    """Storefront product search"""
+    query = request.GET.get('q', '').strip()
+    hoodies = search_hoodies(query, limit=settings.SEARCH_RESULTS_LIMIT) if query else []
     
-    return cart
+    return render(request, 'hoodieHub/search.html', {
+        'query': query,
+        'hoodies': hoodies
+    })
+
+# ========== CART VIEWS ==========
 
 def add_to_cart(request):
     """Add hoodie to cart with stock validation"""
@@ -271,56 +279,59 @@ def add_to_cart(request):
         size = request.POST.get('size')
         quantity = int(request.POST.get('quantity', 1))
         
-        hoodie = get_object_or_404(Hoodie, id=hoodie_id)
-        
-        # Check stock
-        if hoodie.stock_quantity <= 0:
+        # Per-size stock is a single indexed (hoodie, size) lookup
+        variant = get_variant(hoodie_id, size)
+        if variant is None:
             return JsonResponse({
                 'success': False,
-                'message': f'{hoodie.name} is out of stock'
+                'message': 'Selected size is not available'
             })
+        hoodie = variant.hoodie
         
-        # Check if quantity requested exceeds stock
-        if quantity > hoodie.stock_quantity:
+        # Check stock
+        if variant.stock <= 0:
             return JsonResponse({
                 'success': False,
-                'message': f'Only {hoodie.stock_quantity} items available in stock'
+                'message': f'{hoodie.name} ({size}) is out of stock'
             })
         
-        cart = get_or_create_cart(request)
-        
-        # Check if item already in cart
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            hoodie=hoodie,
-            size=size,
-            defaults={'quantity': quantity}
-        )
+        storage = get_cart_storage(request)
+        holder = storage.get_holder()
+        in_cart = storage.get_quantity(hoodie.id, size)
         
-        if not created:
-            # Check if total quantity would exceed stock
-            if (cart_item.quantity + quantity) > hoodie.stock_quantity:
-                return JsonResponse({
-                    'success': False,
-                    'message': f'Only {hoodie.stock_quantity} items available. You already have {cart_item.quantity} in cart'
-                })
-            cart_item.quantity += quantity
-            cart_item.save()
+        try:
+            with transaction.atomic():
+                # Hold the stock for the whole line; fails instead of overselling
+                if not set_held(holder, variant, in_cart + quantity):
+                    variant.refresh_from_db(fields=['stock'])
+                    available = variant.stock + held_quantity(holder, variant)
+                    message = f'Only {available} items available in size {size}'
+                    if in_cart:
+                        message += f'. You already have {in_cart} in cart'
+                    return JsonResponse({
+                        'success': False,
+                        'message': message
+                    })
+                
+                storage.add(hoodie, size, quantity)
+        except CartFull:
+            return JsonResponse({
+                'success': False,
+                'message': 'Your cart is full. Please check out or remove some items first'
+            })
         
         return JsonResponse({
             'success': True,
             'message': f'{hoodie.name} added to cart',
-            'cart_count': cart.get_item_count()
+            'cart_count': storage.get_totals().item_count
         })
     
     return JsonResponse({'success': False, 'message': 'Invalid request'})
 
 def view_cart(request):
     """View cart page"""
-    cart = get_or_create_cart(request)
-    
     return render(request, 'hoodieHub/cart.html', {
-        'cart': cart
+        'summary': get_cart_storage(request).get_summary()
     })
 
 def update_cart_item(request):
@@ -329,26 +340,44 @@ def update_cart_item(request):
         item_id = request.POST.get('item_id')
         quantity = int(request.POST.get('quantity', 1))
         
-        cart_item = get_object_or_404(CartItem, id=item_id)
-        
-        if quantity > 0:
-            cart_item.quantity = quantity
-            cart_item.save()
-        else:
-            cart_item.delete()
+        storage = get_cart_storage(request)
+        line = storage.get_line(item_id)
+        if line is None:
+            raise Http404('No such cart item')
+        
+        holder = storage.get_holder()
+        # The hold and the cart line change together or not at all
+        with transaction.atomic():
+            if quantity > 0:
+                variant = get_variant(line.hoodie_id, line.size)
+                if variant is not None and not set_held(holder, variant, quantity):
+                    variant.refresh_from_db(fields=['stock'])
+                    return JsonResponse({
+                        'success': False,
+                        'message': f'Only {variant.stock + held_quantity(holder, variant)} items available in size {line.size}'
+                    })
+            else:
+                release_line(holder, line.hoodie_id, line.size)
+            
+            storage.set_quantity(item_id, quantity)
         
         return JsonResponse({
             'success': True,
-            'cart_total': cart_item.cart.get_total()
+            'cart_total': storage.get_totals().total
         })
     
     return JsonResponse({'success': False})
 
 def remove_from_cart(request, item_id):
     """Remove item from cart"""
-    cart_item = get_object_or_404(CartItem, id=item_id)
-    cart = cart_item.cart
-    cart_item.delete()
+    storage = get_cart_storage(request)
+    line = storage.get_line(item_id)
+    if line is None:
+        raise Http404('No such cart item')
+    
+    with transaction.atomic():
+        release_line(storage.get_holder(), line.hoodie_id, line.size)
+        storage.remove(item_id)
     
     return redirect('hoodieHub:view_cart')
 
@@ -356,16 +385,42 @@ def remove_from_cart(request, item_id):
 
 def checkout(request):
     """Checkout page"""
-    cart = get_or_create_cart(request)
+    summary = get_cart_storage(request).get_summary()
     
-    if cart.get_item_count() == 0:
+    if summary.is_empty():
         return redirect('hoodieHub:home')
     
     return render(request, 'hoodieHub/checkout.html', {
-        'cart': cart
+        'summary': summary
     })
 
-def process_checkout(request):
+def place_order(request, customer_name, phone_number, delivery_location):
+    """Create the order and its STK push job together, then empty the cart"""
+    storage = get_cart_storage(request)
+    with transaction.atomic():
+        order = create_order_from_cart(
+            storage,
+            user=request.user if request.user.is_authenticated else None,
+            customer_name=customer_name,
+            phone_number=phone_number,
+            delivery_location=delivery_location
+        )
+        
+        # The confirmation page polls for the result of the push
+        job = create_stk_push_job(
+            target_id=order.id,
+            result_handler='hoodieHub.orders.apply_stk_push_result',
+            phone_number=phone_number,
+            amount=order.total_amount,
+            account_reference=f"ORDER-{order.id}",
+            transaction_desc=f"HoodieHub Order"
+        )
+    
+    # Clear cart
+    storage.clear()
+    return order, job
+
+async def process_checkout(request):
     """Process checkout and initiate M-Pesa payment"""
     if request.method == 'POST':
         # Get customer details
@@ -373,66 +428,44 @@ def process_checkout(request):
         phone_number = request.POST.get('phone_number')
         delivery_location = request.POST.get('delivery_location')
         
-        # Get cart
-        cart = get_or_create_cart(request)
-        
-        if cart.get_item_count() == 0:
+        # While Daraja is down, say so at once rather than take the order and
+        # hold its stock for a push that can't be sent
+        if await MpesaService().breaker.ais_open():
             return JsonResponse({
                 'success': False,
-                'message': 'Your cart is empty'
+                'message': UNAVAILABLE_MESSAGE
             })
         
-        # Create order
-        order = Order.objects.create(
-            user=request.user if request.user.is_authenticated else None,
-            customer_name=customer_name,
-            phone_number=phone_number,
-            delivery_location=delivery_location,
-            total_amount=cart.get_total(),
-            status='PENDING'
-        )
-        
-        # Create order items from cart
-        for cart_item in cart.items.all():
-            OrderItem.objects.create(
-                order=order,
-                hoodie_name=cart_item.hoodie.name,
-                size=cart_item.size,
-                quantity=cart_item.quantity,
-                price=cart_item.hoodie.price
+        # Session, cart and order work is synchronous; the push is not
+        try:
+            order, job = await sync_to_async(place_order)(
+                request, customer_name, phone_number, delivery_location
             )
-        
-        # Initiate M-Pesa STK Push
-        mpesa = MpesaService()
-        response = mpesa.stk_push(
-            phone_number=phone_number,
-            amount=order.total_amount,
-            account_reference=f"ORDER-{order.id}",
-            transaction_desc=f"HoodieHub Order"
-        )
-        
-        if response.get('ResponseCode') == '0':
-            # Update order with M-Pesa details
-            order.checkout_request_id = response.get('CheckoutRequestID')
-            order.merchant_request_id = response.get('MerchantRequestID')
-            order.save()
-            
-            # Clear cart
-            cart.items.all().delete()
-            
+        except CheckoutError as e:
             return JsonResponse({
-                'success': True,
-                'message': 'Please check your phone to complete payment',
-                'order_id': str(order.id)
+                'success': False,
+                'message': str(e)
             })
-        else:
-            order.status = 'FAILED'
-            order.save()
-            
+        
+        await send_inline(job)
+        if job.status == StkPushJob.FAILED:
+            # The push was sent inline and didn't go out (or the circuit
+            # opened as this order was placed); the order has been failed
+            # and its stock released
+            if is_unavailable(job.response):
+                message = UNAVAILABLE_MESSAGE
+            else:
+                message = job.response.get('errorMessage', 'Payment failed')
             return JsonResponse({
                 'success': False,
-                'message': response.get('errorMessage', 'Payment failed')
+                'message': message
             })
+        
+        return JsonResponse({
+            'success': True,
+            'message': 'Please check your phone to complete payment',
+            'order_id': str(order.id)
+        })
     
     return JsonResponse({'success': False, 'message': 'Invalid request'})
 
@@ -441,32 +474,13 @@ def process_checkout(request):
 @csrf_exempt
 @require_http_methods(["POST"])
 def mpesa_callback(request):
-    """Handle M-Pesa payment callback"""
+    """Journal an M-Pesa payment callback and ACK; apply_mpesa_callbacks applies it"""
     try:
-        data = json.loads(request.body)
-        
-        result_code = data['Body']['stkCallback']['ResultCode']
-        checkout_request_id = data['Body']['stkCallback']['CheckoutRequestID']
-        
-        # Find order
-        order = Order.objects.get(checkout_request_id=checkout_request_id)
-        
-        if result_code == 0:
-            # Payment successful
-            callback_metadata = data['Body']['stkCallback']['CallbackMetadata']['Item']
-            for item in callback_metadata:
-                if item['Name'] == 'MpesaReceiptNumber':
-                    order.mpesa_receipt_number = item['Value']
-            
-            order.status = 'PAID'
-        else:
-            order.status = 'FAILED'
-        
-        order.save()
-        
-        return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Accepted'})
-    except Exception as e:
+        record_callback(json.loads(request.body), 'hoodieHub.orders.apply_order_callbacks')
+    except (KeyError, TypeError, ValueError) as e:
         return JsonResponse({'ResultCode': 1, 'ResultDesc': str(e)})
+    
+    return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Accepted'})
 
 # ========== ORDER VIEWS ==========
 
@@ -475,18 +489,79 @@ def order_confirmation(request, order_id):
     order = get_object_or_404(Order, id=order_id)
     
     return render(request, 'hoodieHub/order_confirmation.html', {
-        'order': order
+        'order': order,
+        'status_push': settings.ORDER_STATUS_PUSH
     })
 
-def check_order_status(request, order_id):
-    """Check order payment status (AJAX)"""
-    order = get_object_or_404(Order, id=order_id)
-    
-    return JsonResponse({
-        'status': order.status,
-        'mpesa_receipt': order.mpesa_receipt_number or ''
-    })
+async def check_order_status(request, order_id):
+    """Check order payment status (AJAX), from the cache when possible"""
+    state = await aget_order_status(order_id)
+    if state is None:
+        raise Http404('Order not found')
+    
+    return JsonResponse(state)
+
+async def order_status_stream(request, order_id):
+    """Push the order's status as Server-Sent Events, or long-poll for it.
+    
+    EventSource clients get a stream that stays open until the order is
+    settled (or ORDER_STATUS_STREAM_TIMEOUT passes and the browser
+    reconnects). Anything else gets JSON as soon as the status differs from
+    the ``status`` query parameter, or after ORDER_STATUS_LONG_POLL_TIMEOUT.
+    
+    Only with ORDER_STATUS_PUSH (i.e. under ASGI); otherwise the current
+    status is returned at once, as by check_order_status.
+    """
+    state = await aget_order_status(order_id)
+    if state is None:
+        raise Http404('Order not found')
+    
+    if not settings.ORDER_STATUS_PUSH:
+        # Under WSGI a held connection pins a worker thread, and a stream is
+        # buffered whole before anything is sent
+        return JsonResponse(state)
+    
+    if 'text/event-stream' not in request.headers.get('Accept', ''):
+        known_status = request.GET.get('status', state['status'])
+        if state['status'] == known_status:
+            changed = await get_hub().wait(order_id, known_status, settings.ORDER_STATUS_LONG_POLL_TIMEOUT)
+            state = changed or state
+        return JsonResponse(state)
+    
+    response = StreamingHttpResponse(order_status_events(order_id, state), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+async def order_status_events(order_id, state):
+    """Yield SSE events for each status change, with keep-alive comments between them"""
+    def event(state):
+        return f'retry: 5000\nevent: status\ndata: {json.dumps(state)}\n\n'
+    
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.ORDER_STATUS_STREAM_TIMEOUT
+    hub = get_hub()
+    
+    yield event(state)
+    while state['status'] == 'PENDING':
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        changed = await hub.wait(order_id, state['status'], min(settings.ORDER_STATUS_HEARTBEAT, remaining))
+        if changed is None:
+            # Keeps proxies from closing an idle connection
+            yield ': keep-alive\n\n'
+        else:
+            state = changed
+            yield event(state)
 
+def receipt_etag(request, order_id):
+    """The stored receipt's digest, or None until there is one"""
+    return Order.objects.filter(id=order_id, status='PAID').values_list('receipt_digest', flat=True).first() or None
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=receipt_etag)
 def download_receipt(request, order_id):
     """Download order receipt PDF"""
     order = get_object_or_404(Order, id=order_id)
@@ -494,87 +569,139 @@ def download_receipt(request, order_id):
     if order.status != 'PAID':
         return HttpResponse('Order not paid yet', status=400)
     
-    # Generate PDF
-    generator = OrderReceiptGenerator(order)
-    pdf_buffer = generator.generate()
-    
-    response = HttpResponse(pdf_buffer, content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="receipt_{order.id}.pdf"'
-    
+    # Stored when the order was paid; sending it is just a file read
+    digest = get_receipt(order)
+    response = receipt_response(digest, f'receipt_{order.id}.pdf')
+    response['ETag'] = f'"{digest}"'
     return response
 
 
 # ========== SEO ==========
 
 def sitemap(request):
-    """Generate XML sitemap for search engines"""
-    xml = '<?xml version="1.0" encoding="UTF-8"?>\n'
-    xml += '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" '
-    xml += 'xmlns:image="http://www.google.com/schemas/sitemap-image/1.1">\n'
-    
-    # Get the domain
+    """Sitemap index listing the static pages and product shards"""
     domain = request.build_absolute_uri('/').rstrip('/')
     
-    # Static pages with high priority
-    static_urls = [
-        (reverse('hoodieHub:home'), '1.0', 'weekly'),
-        (reverse('hoodieHub:view_cart'), '0.8', 'weekly'),
-    ]
-    
-    for url, priority, changefreq in static_urls:
-        full_url = f"{domain}{url}"
-        xml += f'  <url>\n'
-        xml += f'    <loc>{full_url}</loc>\n'
-        xml += f'    <priority>{priority}</priority>\n'
-        xml += f'    <changefreq>{changefreq}</changefreq>\n'
-        xml += f'  </url>\n'
-    
-    # Product pages
-    hoodies = Hoodie.objects.all()
-    for hoodie in hoodies:
-        url = reverse('hoodieHub:hoodie_detail', args=[hoodie.id])
-        full_url = f"{domain}{url}"
-        
-        xml += f'  <url>\n'
-        xml += f'    <loc>{full_url}</loc>\n'
-        xml += f'    <lastmod>{hoodie.created_at.isoformat() if hasattr(hoodie, "created_at") else ""}</lastmod>\n'
-        xml += f'    <priority>0.9</priority>\n'
-        xml += f'    <changefreq>monthly</changefreq>\n'
-        
-        # Add image if available
-        if hoodie.image:
-            image_url = f"{domain}{hoodie.image.url}"
-            xml += f'    <image:image>\n'
-            xml += f'      <image:loc>{image_url}</image:loc>\n'
-            xml += f'      <image:title>{hoodie.name}</image:title>\n'
-            xml += f'    </image:image>\n'
-        
-        xml += f'  </url>\n'
-    
-    xml += '</urlset>'
+    xml = get_cached_section(domain, 'index')
+    if xml is None:
+        xml = render_index(domain)
+        cache_section(domain, 'index', xml)
     
     return HttpResponse(xml, content_type='application/xml')
 
+def sitemap_pages(request):
+    """Sitemap of the static pages"""
+    domain = request.build_absolute_uri('/').rstrip('/')
+    return stream_sitemap_section(domain, 'pages', generate_pages(domain))
+
+def sitemap_products(request, shard):
+    """One fixed-size shard of the product sitemap"""
+    if shard < 1 or shard > product_shard_count():
+        raise Http404('No such sitemap')
+    
+    domain = request.build_absolute_uri('/').rstrip('/')
+    return stream_sitemap_section(domain, f'products-{shard}', generate_products(domain, shard))
+
+def stream_sitemap_section(domain, section, chunks):
+    """Serve a cached sitemap section, or stream and cache it"""
+    xml = get_cached_section(domain, section)
+    if xml is not None:
+        chunks.close()
+        return HttpResponse(xml, content_type='application/xml')
+    
+    return StreamingHttpResponse(
+        cache_while_streaming(chunks, domain, section),
+        content_type='application/xml'
+    )
+
 
 # ========== CART DATA ==========
 
 def get_cart_data(request):
     """Get cart data as JSON for AJAX updates"""
-    cart = get_or_create_cart(request)
-    
-    items = []
-    for item in cart.items.all():
-        items.append({
-            'id': str(item.id),
-            'hoodie_name': item.hoodie.name,
-            'size': item.size,
-            'quantity': item.quantity,
-            'price': str(item.hoodie.price),
-            'subtotal': str(item.get_subtotal())
+    return JsonResponse(get_cart_storage(request).get_summary().as_dict())
+
+@require_http_methods(["POST"])
+def cart_batch(request):
+    """Apply a list of add/update/remove operations to the cart in one request.
+    
+    Body: {"operations": [{"op": "add", "hoodie_id": ..., "size": ..., "quantity": ...},
+                          {"op": "update", "item_id": ..., "quantity": ...},
+                          {"op": "remove", "item_id": ...}]}
+    Either every operation is applied or none is. Returns the new cart data.
+    """
+    try:
+        operations = json.loads(request.body)['operations']
+        if not isinstance(operations, list):
+            raise TypeError
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'success': False, 'message': 'Invalid request'})
+    
+    if len(operations) > settings.CART_BATCH_MAX_OPERATIONS:
+        return JsonResponse({
+            'success': False,
+            'message': f'At most {settings.CART_BATCH_MAX_OPERATIONS} changes can be sent at once'
         })
     
-    return JsonResponse({
-        'item_count': cart.get_item_count(),
-        'total': str(cart.get_total()),
-        'items': items
-    })
\ No newline at end of file
+    storage = get_cart_storage(request)
+    summary = storage.get_summary()
+    lines = {str(item.id): (item.hoodie_id, item.size) for item in summary.items}
+    quantities = {(item.hoodie_id, item.size): item.quantity for item in summary.items}
+    
+    # Replay the operations against the current lines in memory first
+    changes = {}
+    try:
+        for operation in operations:
+            op = operation.get('op')
+            if op == 'add':
+                key = (uuid.UUID(str(operation.get('hoodie_id'))), str(operation.get('size')))
+                quantity = int(operation.get('quantity', 1))
+                if quantity < 1:
+                    raise ValueError
+                changes[key] = changes.get(key, quantities.get(key, 0)) + quantity
+            elif op in ('update', 'remove'):
+                key = lines.get(str(operation.get('item_id')))
+                if key is None:
+                    return JsonResponse({'success': False, 'message': 'Item is no longer in your cart'})
+                changes[key] = max(int(operation.get('quantity', 0)), 0) if op == 'update' else 0
+            else:
+                raise ValueError
+    except (AttributeError, TypeError, ValueError):
+        return JsonResponse({'success': False, 'message': 'Invalid request'})
+    
+    changes = {key: quantity for key, quantity in changes.items() if quantity != quantities.get(key, 0)}
+    if changes:
+        variants = {
+            (variant.hoodie_id, variant.size): variant
+            for variant in HoodieVariant.objects.select_related('hoodie').filter(
+                hoodie_id__in={hoodie_id for hoodie_id, size in changes},
+                hoodie__is_active=True
+            )
+        }
+        holder = storage.get_holder()
+        
+        try:
+            with transaction.atomic():
+                for (hoodie_id, size), quantity in changes.items():
+                    variant = variants.get((hoodie_id, size))
+                    if variant is None:
+                        if quantity > 0:
+                            raise CartBatchError('Selected size is not available')
+                        release_line(holder, hoodie_id, size)
+                    elif not set_held(holder, variant, quantity):
+                        variant.refresh_from_db(fields=['stock'])
+                        available = variant.stock + held_quantity(holder, variant)
+                        raise CartBatchError(f'Only {available} of {variant.hoodie.name} ({size}) available')
+                
+                storage.set_lines(changes)
+        except CartBatchError as e:
+            return JsonResponse({'success': False, 'message': str(e)})
+        except CartFull:
+            return JsonResponse({
+                'success': False,
+                'message': 'Your cart is full. Please check out or remove some items first'
+            })
+        
+        summary = storage.get_summary()
+    
+    return JsonResponse({'success': True, **summary.as_dict()})
@@ -47,6 +47,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'hoodieHub.middleware.CartStorageMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -120,8 +121,134 @@ USE_TZ = True
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+    # Order receipt PDFs (hoodieHub.receipts); private, so kept out of MEDIA_ROOT
+    'receipts': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {'location': os.path.join(BASE_DIR, 'receipts')},
+    },
+}
+
+# Let the web server send stored receipts: 'X-Accel-Redirect' (nginx, with an
+# internal location at RECEIPT_SENDFILE_URL aliased to the receipts storage)
+# or 'X-Sendfile' (Apache mod_xsendfile, lighttpd). None streams them from Django.
+RECEIPT_SENDFILE_HEADER = None
+RECEIPT_SENDFILE_URL = '/protected/receipts/'
+
+# Cache
+# Use a shared backend (Redis/Memcached) in production so all workers see
+# the same catalog version
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'hoodie-hub',
+    }
+}
+
+# Catalog cache
+CATALOG_CACHE_TIMEOUT = 86400  # Snapshots are versioned, so this only bounds memory
+CATALOG_LOCAL_TTL = 5  # Seconds a worker trusts its in-process copy
+CATALOG_LOCAL_MAX_PAGES = 64
+CATALOG_PAGE_SIZE = 12
+
+# Sitemap
+SITEMAP_SHARD_SIZE = 5000  # URLs per product sitemap (the protocol allows up to 50,000)
+
+# Product search
+SEARCH_RESULTS_LIMIT = 48
+
+# Image derivatives
+IMAGE_DERIVATIVE_WORKERS = 2  # Resizer processes per web worker
+
+# Cart storage for anonymous visitors. 'hoodieHub.cart.SignedCookieCartStorage'
+# keeps guest carts in a signed cookie so they cost no database writes until
+# checkout or login; signed-in users always use the database.
+CART_GUEST_STORAGE = 'hoodieHub.cart.DatabaseCartStorage'
+CART_COOKIE_NAME = 'hoodiehub_cart'
+CART_COOKIE_AGE = 86400 * 30  # 30 days
+CART_COOKIE_MAX_LINES = 40  # Keeps the cookie well under the 4KB browser limit
+CART_BATCH_MAX_OPERATIONS = 50  # Per request to cart/batch/
+
+# Stock reservations
+RESERVATION_CART_TTL = 60 * 15  # Seconds a cart holds stock after its last change
+RESERVATION_CHECKOUT_TTL = 60 * 30  # Seconds an unpaid order holds its stock
+
+# M-Pesa STK push queue. Pushes are sent by `manage.py run_stk_push_worker`;
+# set MPESA_STK_PUSH_QUEUE = False to send them inline when no worker runs.
+MPESA_STK_PUSH_QUEUE = True
+MPESA_STK_PUSH_WORKERS = 8  # Worker threads, i.e. pushes in flight per worker
+# Seconds before a running job is presumed lost. Must outlast the slowest
+# push: waiting on another process's token refresh, a token fetch with all
+# its retries and the push itself, twice over if Daraja rejects the token
+# (about 7 minutes with the timeouts below)
+MPESA_STK_PUSH_JOB_TIMEOUT = 600
+MPESA_TOKEN_REFRESH_MARGIN = 60  # Refresh the cached OAuth token this many seconds before it expires
+
+# M-Pesa callbacks are journalled on arrival and applied by `manage.py
+# apply_mpesa_callbacks`; set MPESA_CALLBACK_QUEUE = False to apply them inline.
+MPESA_CALLBACK_QUEUE = True
+MPESA_CALLBACK_BATCH_SIZE = 500  # Callbacks applied per transaction
+
+# `manage.py reconcile_stk_payments` queries Daraja for pushes whose callback
+# never came: (model, pending status, callback handler) for each kind of push
+MPESA_RECONCILE_TARGETS = [
+    ('hoodieHub.Order', 'PENDING', 'hoodieHub.orders.apply_order_callbacks'),
+    ('payments.Payment', 'pending', 'payments.callbacks.apply_payment_callbacks'),
+]
+MPESA_RECONCILE_AFTER = 120  # Seconds without a callback before a push is queried
+MPESA_RECONCILE_CONCURRENCY = 10  # Queries in flight at once
+MPESA_RECONCILE_RATE = 5  # Queries per second, to stay under Daraja's rate limits
+
+# Daraja HTTP client
+MPESA_HTTP_POOL_SIZE = 20  # Keep-alive connections per process; match MPESA_STK_PUSH_WORKERS or more
+MPESA_ASYNC_POOL_SIZE = 100  # Connections per event loop for the async client (ASGI)
+# Send inline pushes (MPESA_STK_PUSH_QUEUE = False) on the async client rather
+# than the pooled sync session. Only under an ASGI server, whose event loop
+# outlives each request
+MPESA_ASYNC_INLINE = False
+MPESA_CONNECT_TIMEOUT = 3.05
+MPESA_READ_TIMEOUT = 30
+MPESA_MAX_RETRIES = 3  # For idempotent calls (token, status queries)
+MPESA_RETRY_BACKOFF = 0.5  # Seconds; doubled per attempt, with jitter
+MPESA_RETRY_MAX_BACKOFF = 8
+
+# Circuit breaker (payments.breaker): after this many failed Daraja calls
+# within the window, every call fails at once for the cooldown, then one
+# probe call decides whether to close the circuit again. Its state lives in
+# the default cache, so with LocMemCache each process has its own breaker;
+# use a shared cache for one breaker across all workers
+MPESA_BREAKER_FAILURE_THRESHOLD = 5
+MPESA_BREAKER_WINDOW = 30  # Seconds
+MPESA_BREAKER_COOLDOWN = 30  # Seconds
+MPESA_BREAKER_PROBE_TIMEOUT = 60  # Seconds before a probe that never reported is given up on
+
+# Order and payment status caching and push (hoodieHub.status_hub, payments.status)
+# Statuses are only cached when CACHES['default'] is shared between processes;
+# with LocMemCache they are read from the database, which always has the truth
+ORDER_STATUS_CACHE_TIMEOUT = 60 * 60  # Seconds a cached status projection is kept
+PAYMENT_STATUS_CACHE_TIMEOUT = 60 * 60
+STATUS_MISSING_CACHE_TIMEOUT = 10  # Seconds an unknown order or payment id is remembered
+# Push status changes to confirmation pages over SSE/long-poll. Needs the
+# site served by an ASGI server (e.g. `uvicorn hoodie_hub.asgi:application`
+# or daphne); under runserver/WSGI pages poll check_order_status instead
+ORDER_STATUS_PUSH = False
+ORDER_STATUS_POLL_INTERVAL = 1  # Seconds between each process's cache check for changes
+ORDER_STATUS_STREAM_TIMEOUT = 60 * 5  # Seconds an SSE stream stays open before the browser reconnects
+ORDER_STATUS_LONG_POLL_TIMEOUT = 25
+ORDER_STATUS_HEARTBEAT = 15  # Seconds between SSE keep-alive comments
+
 # Session settings
 SESSION_COOKIE_AGE = 86400 * 7  # 1 week
 SESSION_SAVE_EVERY_REQUEST = True
 
+# Guest carts untouched for this long are deleted by purge_stale_carts. Their
+# session (which holds the cart key) has expired by then anyway.
+CART_GUEST_MAX_AGE = SESSION_COOKIE_AGE
+
 STATIC_URL = 'static/'
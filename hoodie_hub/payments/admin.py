@@ -1,9 +1,24 @@
 from django.contrib import admin
-from .models import Payment
+from .models import MpesaCallback, Payment, StkPushJob
 
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
     list_display = ['phone_number', 'amount', 'status', 'created_at']
     list_filter = ['status', 'created_at']
-    search_fields = ['phone_number', 'mpesa_receipt_number']
-    readonly_fields = ['id', 'created_at', 'updated_at']
\ No newline at end of file
+    search_fields = ['phone_number', 'mpesa_receipt_number', 'checkout_request_id']
+    readonly_fields = ['id', 'created_at', 'updated_at']
+
+@admin.register(StkPushJob)
+class StkPushJobAdmin(admin.ModelAdmin):
+    list_display = ['account_reference', 'phone_number', 'amount', 'status', 'created_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['account_reference', 'phone_number']
+    readonly_fields = ['id', 'target_id', 'result_handler', 'response', 'started_at', 'created_at', 'updated_at']
+
+
+@admin.register(MpesaCallback)
+class MpesaCallbackAdmin(admin.ModelAdmin):
+    list_display = ['checkout_request_id', 'result_code', 'source', 'status', 'created_at', 'applied_at']
+    list_filter = ['status', 'source', 'created_at']
+    search_fields = ['checkout_request_id']
+    readonly_fields = ['id', 'checkout_request_id', 'result_code', 'source', 'payload', 'handler', 'created_at', 'applied_at']
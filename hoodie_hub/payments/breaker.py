@@ -0,0 +1,117 @@
+"""Circuit breaker for Daraja, kept in the cache.
+
+Failed calls (connection errors, timeouts, 429/5xx) are counted in
+time buckets covering the last MPESA_BREAKER_WINDOW seconds. Once they
+reach MPESA_BREAKER_FAILURE_THRESHOLD the circuit opens: for
+MPESA_BREAKER_COOLDOWN seconds every caller fails at once instead of
+waiting out a timeout. After that a single probe call is let through
+(half-open); its success closes the circuit and its failure opens it again.
+Calls that started before the circuit opened and finish while it is open
+are ignored, so only the probe decides.
+
+Every process shares the breaker only if the cache is shared (e.g. Redis
+or Memcached); with LocMemCache each process trips on its own failures.
+"""
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+BREAKER_KEY = 'payments:mpesa:breaker:{account}:{part}'
+BUCKETS = 6  # Buckets per window
+
+# errorCode of the response MpesaService returns instead of calling Daraja
+CIRCUIT_OPEN = 'circuit_open'
+UNAVAILABLE_MESSAGE = 'M-Pesa is not responding right now. Please try again shortly.'
+
+
+def unavailable_response():
+    return {
+        'ResponseCode': '1',
+        'errorCode': CIRCUIT_OPEN,
+        'errorMessage': UNAVAILABLE_MESSAGE
+    }
+
+
+def is_unavailable(response):
+    """Whether an M-Pesa response is a fast failure from an open circuit"""
+    return bool(response) and response.get('errorCode') == CIRCUIT_OPEN
+
+
+class CircuitBreaker:
+    def __init__(self, account):
+        self.open_key = BREAKER_KEY.format(account=account, part='open-until')
+        self.probe_key = BREAKER_KEY.format(account=account, part='probe')
+        self.failures_key = BREAKER_KEY.format(account=account, part='failures:{bucket}')
+
+    def _buckets(self, now):
+        size = max(settings.MPESA_BREAKER_WINDOW / BUCKETS, 1)
+        current = int(now // size)
+        return [self.failures_key.format(bucket=bucket) for bucket in range(current - BUCKETS + 1, current + 1)]
+
+    def is_open(self):
+        """True while calls are refused: for the cooldown, then while the probe is out"""
+        open_until = cache.get(self.open_key)
+        if open_until is None:
+            return False
+        return time.time() < open_until or cache.get(self.probe_key) is not None
+
+    def allow(self):
+        """Whether a call may go ahead; call once per operation, before any request"""
+        open_until = cache.get(self.open_key)
+        if open_until is None:
+            return True
+        if time.time() < open_until:
+            return False
+        # Half-open: only one caller, anywhere, gets to probe
+        return cache.add(self.probe_key, True, settings.MPESA_BREAKER_PROBE_TIMEOUT)
+
+    def record_success(self, started_at):
+        """Report a call that went through; ``started_at`` is its time.time() at the start"""
+        open_until = cache.get(self.open_key)
+        if open_until is not None and started_at >= open_until:
+            # The probe got through; start counting afresh
+            cache.delete_many([self.open_key, self.probe_key] + self._buckets(time.time()))
+
+    def record_failure(self, started_at):
+        """Report a failed call; ``started_at`` is its time.time() at the start"""
+        now = time.time()
+        open_until = cache.get(self.open_key)
+        if open_until is not None:
+            # Only the probe starts after the cooldown; a call that was already
+            # in flight when the circuit opened changes nothing
+            if started_at >= open_until:
+                self.trip(now)
+            return
+
+        buckets = self._buckets(now)
+        cache.add(buckets[-1], 0, settings.MPESA_BREAKER_WINDOW * 2)
+        try:
+            cache.incr(buckets[-1])
+        except ValueError:
+            # Evicted between add and incr
+            cache.set(buckets[-1], 1, settings.MPESA_BREAKER_WINDOW * 2)
+
+        failures = sum(cache.get_many(buckets).values())
+        if failures >= settings.MPESA_BREAKER_FAILURE_THRESHOLD:
+            self.trip(now)
+
+    def trip(self, now):
+        cooldown = settings.MPESA_BREAKER_COOLDOWN
+        # Outlives the cooldown so the next caller probes; expires if nobody does
+        cache.set(self.open_key, now + cooldown, cooldown + settings.MPESA_BREAKER_WINDOW)
+        cache.delete(self.probe_key)
+        print(f"Daraja circuit opened for {cooldown}s")
+
+    async def ais_open(self):
+        return await sync_to_async(self.is_open)()
+
+    async def aallow(self):
+        return await sync_to_async(self.allow)()
+
+    async def arecord_success(self, started_at):
+        await sync_to_async(self.record_success)(started_at)
+
+    async def arecord_failure(self, started_at):
+        await sync_to_async(self.record_failure)(started_at)
@@ -0,0 +1,177 @@
+"""Journal for M-Pesa STK push callbacks.
+
+The callback endpoints only append the raw callback to MpesaCallback and
+ACK, which is one indexed INSERT however many orders exist. ``manage.py
+apply_mpesa_callbacks`` then applies pending callbacks in batches through
+each callback's handler. With MPESA_CALLBACK_QUEUE turned off they are
+applied as they arrive instead, for development without a worker.
+
+A callback can beat the STK push result that records its CheckoutRequestID
+(see payments.jobs); it is parked as UNMATCHED and queued again once that
+result is saved.
+
+An STK query result (see payments.reconcile) is journalled under its own
+source, so the real callback is still applied if it turns up later; it only
+fills in the receipt number the query couldn't provide.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import MpesaCallback, Payment
+from .status import publish_payment_status
+
+
+def record_callback(data, handler, source=MpesaCallback.CALLBACK):
+    """Journal a callback body; ``handler`` is the dotted path of a function(callbacks).
+
+    Raises KeyError, TypeError or ValueError for a malformed body.
+    """
+    callback = data['Body']['stkCallback']
+    # ON CONFLICT DO NOTHING: a repeated callback is dropped without an error
+    MpesaCallback.objects.bulk_create([
+        MpesaCallback(
+            checkout_request_id=callback['CheckoutRequestID'],
+            result_code=int(callback['ResultCode']),
+            payload=data,
+            handler=handler,
+            source=source
+        )
+    ], ignore_conflicts=True)
+
+    if not settings.MPESA_CALLBACK_QUEUE:
+        transaction.on_commit(apply_callbacks)
+
+
+def requeue_unmatched(*checkout_request_ids):
+    """Retry callbacks that arrived before their CheckoutRequestID was saved"""
+    requeued = MpesaCallback.objects.filter(
+        checkout_request_id__in=checkout_request_ids,
+        status=MpesaCallback.UNMATCHED
+    ).update(status=MpesaCallback.PENDING)
+
+    if requeued and not settings.MPESA_CALLBACK_QUEUE:
+        transaction.on_commit(apply_callbacks)
+
+
+def apply_callbacks(batch_size=None):
+    """Apply one batch of the oldest pending callbacks, returning how many were taken.
+
+    Every callback in the batch leaves PENDING, so a caller can loop until
+    fewer than ``batch_size`` come back.
+    """
+    batch_size = batch_size or settings.MPESA_CALLBACK_BATCH_SIZE
+
+    with transaction.atomic():
+        pending = MpesaCallback.objects.filter(status=MpesaCallback.PENDING).order_by('created_at')
+        if connection.features.has_select_for_update_skip_locked:
+            # Several workers can share the journal
+            pending = pending.select_for_update(skip_locked=True)
+        batch = list(pending[:batch_size])
+        if not batch:
+            return 0
+
+        by_handler = defaultdict(list)
+        for callback in batch:
+            by_handler[callback.handler].append(callback)
+
+        for handler, callbacks in by_handler.items():
+            try:
+                with transaction.atomic():
+                    import_string(handler)(callbacks)
+            except Exception as e:
+                print(f"Error applying M-Pesa callbacks with {handler}: {e}")
+                for callback in callbacks:
+                    callback.status = MpesaCallback.FAILED
+
+        now = timezone.now()
+        for callback in batch:
+            if callback.status == MpesaCallback.PENDING:
+                # The handler didn't say; treat it as applied
+                callback.status = MpesaCallback.APPLIED
+            callback.applied_at = now
+        MpesaCallback.objects.bulk_update(batch, ['status', 'applied_at'])
+
+    return len(batch)
+
+
+def settle_each(callbacks, model, settle):
+    """Match callbacks to ``model`` rows by CheckoutRequestID and settle each one.
+
+    ``settle(target, callback)`` runs in its own savepoint, so one bad row
+    fails only its own callback. The lookup is a single indexed IN query
+    for the whole batch.
+    """
+    targets = model.objects.in_bulk(
+        [callback.checkout_request_id for callback in callbacks],
+        field_name='checkout_request_id'
+    )
+    unmatched = []
+    for callback in callbacks:
+        target = targets.get(callback.checkout_request_id)
+        if target is None:
+            callback.status = MpesaCallback.UNMATCHED
+            unmatched.append(callback.checkout_request_id)
+            continue
+
+        try:
+            with transaction.atomic():
+                settle(target, callback)
+            callback.status = MpesaCallback.APPLIED
+        except Exception as e:
+            print(f"Error applying M-Pesa callback {callback.checkout_request_id}: {e}")
+            callback.status = MpesaCallback.FAILED
+
+    if unmatched:
+        # The push result may have been saved after the lookup above, and its
+        # requeue_unmatched run before these were marked UNMATCHED; look again
+        # once they are
+        transaction.on_commit(lambda: requeue_matched(model, unmatched))
+
+
+def requeue_matched(model, checkout_request_ids):
+    """requeue_unmatched for those of ``checkout_request_ids`` that ``model`` now has"""
+    found = list(model.objects.filter(checkout_request_id__in=checkout_request_ids).values_list(
+        'checkout_request_id', flat=True
+    ))
+    if found:
+        requeue_unmatched(*found)
+
+
+def settle_payment(payment, paid, receipt_number=''):
+    """Mark a pending payment completed or failed; a settled payment is left alone"""
+    fields = {'status': 'completed' if paid else 'failed', 'updated_at': timezone.now()}
+    if paid:
+        fields['mpesa_receipt_number'] = receipt_number
+    if not Payment.objects.filter(pk=payment.pk, status='pending').update(**fields):
+        if paid and receipt_number:
+            add_payment_receipt_number(payment, receipt_number)
+        return
+    
+    payment.status = fields['status']
+    if paid:
+        payment.mpesa_receipt_number = receipt_number
+    # update() skips the post_save write-through, so publish here
+    transaction.on_commit(lambda: publish_payment_status(payment))
+
+
+def add_payment_receipt_number(payment, receipt_number):
+    """Fill in the receipt number of a payment settled by an STK query, which has none"""
+    if Payment.objects.filter(pk=payment.pk, status='completed', mpesa_receipt_number='').update(
+        mpesa_receipt_number=receipt_number,
+        updated_at=timezone.now()
+    ):
+        payment.mpesa_receipt_number = receipt_number
+        transaction.on_commit(lambda: publish_payment_status(payment))
+
+
+def apply_payment_callbacks(callbacks):
+    """Callback handler for payments created by initiate_payment"""
+    settle_each(callbacks, Payment, lambda payment, callback: settle_payment(
+        payment,
+        callback.result_code == 0,
+        str(callback.metadata.get('MpesaReceiptNumber') or '')
+    ))
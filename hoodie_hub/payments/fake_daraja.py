@@ -0,0 +1,301 @@
+"""A local stand-in for Safaricom's Daraja API, for offline and load testing.
+
+Implements the three endpoints MpesaService uses: OAuth token, STK push and
+STK Push Query. Each accepted push is settled after a delay by POSTing an
+stkCallback to its CallBackURL, the way Daraja does once the customer
+answers the prompt on their phone. Latency, error rate, decline rate and
+lost callbacks are all configurable, so the queue, callback journal and
+reconciler can be exercised under load without a network.
+
+Run it with ``manage.py run_fake_daraja`` and point the app at it with
+MPESA_BASE_URL, or start one inside a test::
+
+    with FakeDaraja(callback_delay=0.1) as daraja:
+        ...  # MPESA_BASE_URL=daraja.url
+"""
+import base64
+import heapq
+import itertools
+import json
+import random
+import secrets
+import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import requests
+
+PUSH_REQUIRED_FIELDS = [
+    'BusinessShortCode', 'Password', 'Timestamp', 'TransactionType', 'Amount',
+    'PartyA', 'PartyB', 'PhoneNumber', 'CallBackURL', 'AccountReference', 'TransactionDesc'
+]
+
+# Result codes Daraja reports for a push the customer didn't pay
+DECLINES = [
+    (1032, 'Request cancelled by user'),
+    (1037, 'DS timeout user cannot be reached'),
+    (1, 'The balance is insufficient for the transaction'),
+]
+
+
+class FakeDaraja:
+    """A threaded HTTP server answering like Daraja's OAuth, STK push and STK query APIs"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 decline_rate=0.0, drop_callback_rate=0.0, callback_delay=2.0, callback_url=None,
+                 token_ttl=3599, callback_workers=8, log=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.decline_rate = decline_rate
+        self.drop_callback_rate = drop_callback_rate
+        self.callback_delay = callback_delay
+        self.callback_url = callback_url  # Overrides each push's CallBackURL
+        self.token_ttl = token_ttl
+        self.callback_workers = callback_workers
+        self.log = log
+
+        self.tokens = {}  # token -> expiry (monotonic)
+        self.pushes = {}  # CheckoutRequestID -> push state
+        self.stats = dict.fromkeys(
+            ['tokens', 'pushes', 'queries', 'errors', 'callbacks', 'callbacks_dropped', 'callbacks_failed'], 0
+        )
+        self.lock = threading.Lock()
+
+        self._due = []  # Heap of (due, seq, CheckoutRequestID) callbacks
+        self._due_changed = threading.Condition(self.lock)
+        self._seq = itertools.count()
+        self._stopping = False
+        self._server = None
+        self._threads = []
+        self._callback_pool = None
+        self._session = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), _Handler)
+        self._server.daemon_threads = True
+        self._server.daraja = self
+        self._callback_pool = ThreadPoolExecutor(max_workers=self.callback_workers)
+        self._session = requests.Session()
+        self._stopping = False
+
+        for target in (self._server.serve_forever, self._dispatch_callbacks):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        with self.lock:
+            self._stopping = True
+            self._due_changed.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._callback_pool.shutdown(wait=True)
+        self._session.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _log(self, message):
+        if self.log:
+            self.log(message)
+
+    # ========== ENDPOINTS ==========
+
+    def issue_token(self, authorization):
+        if not authorization.startswith('Basic '):
+            return 400, {'errorCode': '400.008.01', 'errorMessage': 'Invalid Authentication passed'}
+        try:
+            base64.b64decode(authorization[6:], validate=True)
+        except ValueError:
+            return 400, {'errorCode': '400.008.01', 'errorMessage': 'Invalid Authentication passed'}
+
+        token = secrets.token_urlsafe(24)
+        with self.lock:
+            self.tokens[token] = time.monotonic() + self.token_ttl
+            self.stats['tokens'] += 1
+        return 200, {'access_token': token, 'expires_in': str(self.token_ttl)}
+
+    def check_token(self, authorization):
+        token = authorization[7:] if authorization.startswith('Bearer ') else ''
+        with self.lock:
+            expires_at = self.tokens.get(token)
+        return expires_at is not None and expires_at > time.monotonic()
+
+    def stk_push(self, payload):
+        for field in PUSH_REQUIRED_FIELDS:
+            if not payload.get(field):
+                return 400, {'errorCode': '400.002.02', 'errorMessage': f'Bad Request - Invalid {field}'}
+
+        checkout_request_id = f"ws_CO_{datetime.now():%d%m%Y%H%M%S}{random.randint(0, 10 ** 9):09d}"
+        merchant_request_id = f"{random.randint(10000, 99999)}-{random.randint(10 ** 7, 10 ** 8 - 1)}-1"
+        if random.random() < self.decline_rate:
+            result = random.choice(DECLINES)
+        else:
+            result = (0, 'The service request is processed successfully.')
+
+        with self.lock:
+            self.pushes[checkout_request_id] = {
+                'merchant_request_id': merchant_request_id,
+                'payload': payload,
+                'result': result,
+                'settled': False,
+            }
+            heapq.heappush(self._due, (time.monotonic() + self.callback_delay, next(self._seq), checkout_request_id))
+            self._due_changed.notify()
+            self.stats['pushes'] += 1
+
+        return 200, {
+            'MerchantRequestID': merchant_request_id,
+            'CheckoutRequestID': checkout_request_id,
+            'ResponseCode': '0',
+            'ResponseDescription': 'Success. Request accepted for processing',
+            'CustomerMessage': 'Success. Request accepted for processing'
+        }
+
+    def stk_query(self, payload):
+        checkout_request_id = payload.get('CheckoutRequestID', '')
+        with self.lock:
+            push = self.pushes.get(checkout_request_id)
+            self.stats['queries'] += 1
+
+        if push is None:
+            return 400, {'errorCode': '400.002.02', 'errorMessage': 'Bad Request - Invalid CheckoutRequestID'}
+        if not push['settled']:
+            return 500, {'errorCode': '500.001.1001', 'errorMessage': 'The transaction is being processed'}
+
+        result_code, result_desc = push['result']
+        return 200, {
+            'ResponseCode': '0',
+            'ResponseDescription': 'The service request has been accepted successsfully',
+            'MerchantRequestID': push['merchant_request_id'],
+            'CheckoutRequestID': checkout_request_id,
+            'ResultCode': str(result_code),
+            'ResultDesc': result_desc
+        }
+
+    # ========== CALLBACKS ==========
+
+    def _dispatch_callbacks(self):
+        """Settle each push when its delay is up and hand its callback to the pool"""
+        with self.lock:
+            while not self._stopping:
+                if not self._due:
+                    self._due_changed.wait()
+                    continue
+                due, _, checkout_request_id = self._due[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._due_changed.wait(delay)
+                    continue
+
+                heapq.heappop(self._due)
+                push = self.pushes[checkout_request_id]
+                push['settled'] = True
+                if random.random() < self.drop_callback_rate:
+                    # Lost on the way; only an STK query will find out
+                    self.stats['callbacks_dropped'] += 1
+                    continue
+                self._callback_pool.submit(self._send_callback, checkout_request_id, push)
+
+    def _send_callback(self, checkout_request_id, push):
+        payload = push['payload']
+        result_code, result_desc = push['result']
+        callback = {
+            'MerchantRequestID': push['merchant_request_id'],
+            'CheckoutRequestID': checkout_request_id,
+            'ResultCode': result_code,
+            'ResultDesc': result_desc,
+        }
+        if result_code == 0:
+            callback['CallbackMetadata'] = {'Item': [
+                {'Name': 'Amount', 'Value': payload['Amount']},
+                {'Name': 'MpesaReceiptNumber', 'Value': ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))},
+                {'Name': 'TransactionDate', 'Value': int(f'{datetime.now():%Y%m%d%H%M%S}')},
+                {'Name': 'PhoneNumber', 'Value': int(payload['PhoneNumber'])},
+            ]}
+
+        url = self.callback_url or payload['CallBackURL']
+        try:
+            response = self._session.post(url, json={'Body': {'stkCallback': callback}}, timeout=10)
+            response.raise_for_status()
+            stat = 'callbacks'
+        except requests.exceptions.RequestException as e:
+            print(f"Error sending callback for {checkout_request_id} to {url}: {e}")
+            stat = 'callbacks_failed'
+        with self.lock:
+            self.stats[stat] += 1
+        self._log(f'callback {checkout_request_id} ResultCode={result_code} -> {url}')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API
+
+    def log_message(self, format, *args):
+        self.server.daraja._log(f'{self.address_string()} {format % args}')
+
+    def _respond(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _simulate_network(self):
+        daraja = self.server.daraja
+        delay = daraja.latency + random.uniform(0, daraja.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if random.random() < daraja.error_rate:
+            with daraja.lock:
+                daraja.stats['errors'] += 1
+            self._respond(503, {'errorCode': '503.001.01', 'errorMessage': 'Service Unavailable'})
+            return False
+        return True
+
+    def do_GET(self):
+        daraja = self.server.daraja
+        if urlsplit(self.path).path != '/oauth/v1/generate':
+            return self._respond(404, {'errorCode': '404.001.01', 'errorMessage': 'Resource not found'})
+        if self._simulate_network():
+            self._respond(*daraja.issue_token(self.headers.get('Authorization', '')))
+
+    def do_POST(self):
+        daraja = self.server.daraja
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._respond(400, {'errorCode': '400.002.01', 'errorMessage': 'Invalid JSON'})
+
+        endpoints = {
+            '/mpesa/stkpush/v1/processrequest': daraja.stk_push,
+            '/mpesa/stkpushquery/v1/query': daraja.stk_query,
+        }
+        endpoint = endpoints.get(urlsplit(self.path).path)
+        if endpoint is None:
+            return self._respond(404, {'errorCode': '404.001.01', 'errorMessage': 'Resource not found'})
+        if not self._simulate_network():
+            return
+        if not daraja.check_token(self.headers.get('Authorization', '')):
+            return self._respond(401, {'errorCode': '404.001.04', 'errorMessage': 'Invalid Access Token'})
+        self._respond(*endpoint(payload))
@@ -0,0 +1,205 @@
+"""Database-backed queue for STK pushes.
+
+Views enqueue a job and return straight away; ``manage.py
+run_stk_push_worker`` sends the pushes from a thread pool and hands each
+Daraja response to the job's result handler. With MPESA_STK_PUSH_QUEUE
+turned off the job runs inline instead, for development without a worker.
+
+Async views create the job with create_stk_push_job and then await
+send_inline, which sends it when there is no worker: on the event loop with
+MPESA_ASYNC_INLINE (under ASGI), otherwise on the pooled sync session.
+"""
+import uuid
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .breaker import is_unavailable
+from .callbacks import requeue_unmatched, settle_payment
+from .models import Payment, StkPushJob
+from .mpesa import AsyncMpesaService, MpesaService
+
+
+def create_stk_push_job(target_id, result_handler, phone_number, amount, account_reference, transaction_desc):
+    """Queue an STK push; ``result_handler`` is the dotted path of a function(job, response)"""
+    return StkPushJob.objects.create(
+        target_id=target_id,
+        result_handler=result_handler,
+        phone_number=phone_number,
+        amount=amount,
+        account_reference=account_reference,
+        transaction_desc=transaction_desc
+    )
+
+
+def enqueue_stk_push(**job_fields):
+    """create_stk_push_job, running the job once committed if there is no worker"""
+    job = create_stk_push_job(**job_fields)
+
+    if not settings.MPESA_STK_PUSH_QUEUE:
+        transaction.on_commit(lambda: run_inline_job(job))
+    return job
+
+
+def run_inline_job(job):
+    """Claim and run a job in this process, when there is no worker"""
+    if claim_job(job):
+        run_job(job)
+
+
+async def send_inline(job):
+    """Send a committed job from an async view when there is no worker"""
+    if settings.MPESA_STK_PUSH_QUEUE:
+        return
+    if not await sync_to_async(claim_job)(job):
+        return
+    if settings.MPESA_ASYNC_INLINE:
+        await arun_job(job)
+    else:
+        # Under WSGI every request runs on a new event loop, so an async
+        # client would be built and dropped per push; the sync session is
+        # pooled across requests
+        await sync_to_async(run_job)(job)
+
+
+def claim_job(job):
+    """Mark one queued job as running under a fresh token; False if it was taken"""
+    token = uuid.uuid4().hex
+    started_at = timezone.now()
+    claimed = StkPushJob.objects.filter(pk=job.pk, status=StkPushJob.QUEUED).update(
+        status=StkPushJob.RUNNING,
+        started_at=started_at,
+        claimed_by=token,
+        updated_at=started_at
+    )
+    if claimed:
+        job.status, job.started_at, job.claimed_by = StkPushJob.RUNNING, started_at, token
+    return bool(claimed)
+
+
+def claim_jobs(limit):
+    """Mark up to ``limit`` of the oldest queued jobs as running and return them.
+
+    Without SKIP LOCKED (e.g. SQLite) two workers can read the same ids, so
+    each claim stamps its own token and only returns the jobs it stamped:
+    a job is never sent twice.
+    """
+    token = uuid.uuid4().hex
+    with transaction.atomic():
+        queued = StkPushJob.objects.filter(status=StkPushJob.QUEUED).order_by('created_at')
+        if connection.features.has_select_for_update_skip_locked:
+            # Several workers can claim at once without queueing on each other's locks
+            queued = queued.select_for_update(skip_locked=True)
+        ids = list(queued.values_list('id', flat=True)[:limit])
+        if not ids:
+            return []
+
+        started_at = timezone.now()
+        StkPushJob.objects.filter(id__in=ids, status=StkPushJob.QUEUED).update(
+            status=StkPushJob.RUNNING,
+            started_at=started_at,
+            claimed_by=token,
+            updated_at=started_at
+        )
+    return list(StkPushJob.objects.filter(id__in=ids, claimed_by=token))
+
+
+def run_job(job):
+    """Send one STK push and apply its result"""
+    try:
+        response = MpesaService().stk_push(
+            phone_number=job.phone_number,
+            amount=job.amount,
+            account_reference=job.account_reference,
+            transaction_desc=job.transaction_desc
+        )
+    except Exception as e:
+        print(f"Error running STK push job {job.id}: {e}")
+        response = {'ResponseCode': '1', 'errorMessage': 'Payment request failed'}
+
+    finish_job(job, response)
+
+
+async def arun_job(job):
+    """run_job on the event loop; only applying the result touches the database"""
+    try:
+        response = await AsyncMpesaService().stk_push(
+            phone_number=job.phone_number,
+            amount=job.amount,
+            account_reference=job.account_reference,
+            transaction_desc=job.transaction_desc
+        )
+    except Exception as e:
+        print(f"Error running STK push job {job.id}: {e}")
+        response = {'ResponseCode': '1', 'errorMessage': 'Payment request failed'}
+
+    await sync_to_async(finish_job)(job, response)
+
+
+def finish_job(job, response):
+    """Record a running job's result and apply it.
+
+    Only the claim that set the job running may finish it, so a job the
+    sweeper already failed (or that was claimed again) is left alone.
+    """
+    claim = StkPushJob.objects.filter(pk=job.pk, status=StkPushJob.RUNNING, claimed_by=job.claimed_by)
+
+    if is_unavailable(response) and settings.MPESA_STK_PUSH_QUEUE:
+        # The push never left; a worker sends it again once the circuit closes
+        if claim.update(status=StkPushJob.QUEUED, claimed_by='', updated_at=timezone.now()):
+            job.status, job.claimed_by = StkPushJob.QUEUED, ''
+        return
+
+    status = StkPushJob.DONE if response.get('ResponseCode') == '0' else StkPushJob.FAILED
+    if not claim.update(response=response, status=status, updated_at=timezone.now()):
+        print(f"STK push job {job.id} was finished elsewhere; dropping its result")
+        return
+    job.response, job.status = response, status
+
+    try:
+        import_string(job.result_handler)(job, response)
+    except Exception as e:
+        print(f"Error applying STK push result for job {job.id}: {e}")
+
+    # Its callback may already be waiting in the journal
+    if response.get('ResponseCode') == '0' and response.get('CheckoutRequestID'):
+        requeue_unmatched(response['CheckoutRequestID'])
+
+
+def fail_stale_jobs():
+    """Fail jobs left running by a worker that died.
+
+    They are not retried: the push may already have reached the customer's
+    phone, and a second prompt for the same order is worse than a failure.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.MPESA_STK_PUSH_JOB_TIMEOUT)
+    stale = StkPushJob.objects.filter(status=StkPushJob.RUNNING, started_at__lt=cutoff)
+    for job in stale:
+        finish_job(job, {'ResponseCode': '1', 'errorMessage': 'Payment request timed out'})
+
+
+def worker_run_job(job):
+    """run_job for worker threads, which must manage their own DB connections"""
+    close_old_connections()
+    try:
+        run_job(job)
+    finally:
+        connection.close()
+
+
+def apply_payment_result(job, response):
+    """Result handler for payments created by initiate_payment"""
+    payment = Payment.objects.filter(id=job.target_id).first()
+    if payment is None:
+        return
+
+    if response.get('ResponseCode') == '0':
+        payment.merchant_request_id = response.get('MerchantRequestID')
+        payment.checkout_request_id = response.get('CheckoutRequestID')
+        payment.save(update_fields=['merchant_request_id', 'checkout_request_id', 'updated_at'])
+    else:
+        settle_payment(payment, paid=False)
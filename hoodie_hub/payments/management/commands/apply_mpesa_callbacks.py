@@ -0,0 +1,33 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from payments.callbacks import apply_callbacks
+
+class Command(BaseCommand):
+    help = 'Apply journalled M-Pesa callbacks to their orders and payments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.MPESA_CALLBACK_BATCH_SIZE, help='Callbacks applied per transaction')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when the journal is empty')
+        parser.add_argument('--once', action='store_true', help='Apply every pending callback and exit')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        applied = 0
+
+        while True:
+            count = apply_callbacks(batch_size)
+            applied += count
+            if count == batch_size:
+                # Probably more waiting
+                continue
+
+            if options['once']:
+                break
+            if count:
+                self.stdout.write(f'Applied {applied} callbacks')
+                applied = 0
+            time.sleep(options['poll_interval'])
+
+        self.stdout.write(self.style.SUCCESS(f'Applied {applied} callbacks'))
@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
-from hoodieHub.models import Hoodie
+from django.db import transaction
+from hoodieHub.models import Hoodie, HoodieVariant
 
 class Command(BaseCommand):
     help = 'Create sample hoodie data'
@@ -10,30 +11,35 @@ class Command(BaseCommand):
                 'name': 'Classic Black Hoodie',
                 'description': 'Premium quality black hoodie with soft fleece lining. Perfect for casual wear.',
                 'price': 2500,
-                'available_sizes': 'S,M,L,XL',
-                'stock_quantity': 50
+                'stock': {'S': 10, 'M': 15, 'L': 15, 'XL': 10}
             },
             {
                 'name': 'Urban Grey Hoodie',
                 'description': 'Stylish grey hoodie with modern fit. Great for everyday comfort.',
                 'price': 2800,
-                'available_sizes': 'S,M,L,XL',
-                'stock_quantity': 40
+                'stock': {'S': 10, 'M': 10, 'L': 10, 'XL': 10}
             },
             {
                 'name': 'Navy Blue Hoodie',
                 'description': 'Deep navy blue hoodie with premium cotton blend.',
                 'price': 3000,
-                'available_sizes': 'M,L,XL',
-                'stock_quantity': 30
+                'stock': {'M': 10, 'L': 10, 'XL': 10}
             },
         ]
         
         for hoodie_data in hoodies:
-            hoodie, created = Hoodie.objects.get_or_create(
-                name=hoodie_data['name'],
-                defaults=hoodie_data
-            )
+            stock = hoodie_data.pop('stock')
+            # One transaction so the catalog cache rebuilds with the variants in place
+            with transaction.atomic():
+                hoodie, created = Hoodie.objects.get_or_create(
+                    name=hoodie_data['name'],
+                    defaults=hoodie_data
+                )
+                if created:
+                    HoodieVariant.objects.bulk_create([
+                        HoodieVariant(hoodie=hoodie, size=size, stock=quantity)
+                        for size, quantity in stock.items()
+                    ])
             if created:
                 self.stdout.write(self.style.SUCCESS(f'Created: {hoodie.name}'))
             else:
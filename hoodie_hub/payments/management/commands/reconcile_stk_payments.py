@@ -0,0 +1,45 @@
+import asyncio
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from payments.callbacks import apply_callbacks
+from payments.mpesa import close_async_client
+from payments.reconcile import reconcile
+
+class Command(BaseCommand):
+    help = 'Query M-Pesa for pending orders and payments whose callback never arrived, and settle them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=settings.MPESA_RECONCILE_AFTER, help='Seconds since the push before it is queried')
+        parser.add_argument('--batch-size', type=int, default=100, help='Rows read per query')
+        parser.add_argument('--concurrency', type=int, default=settings.MPESA_RECONCILE_CONCURRENCY, help='Queries in flight at once')
+        parser.add_argument('--rate', type=float, default=settings.MPESA_RECONCILE_RATE, help='Queries per second')
+        parser.add_argument('--loop', action='store_true', help='Keep running, sweeping every --interval seconds')
+        parser.add_argument('--interval', type=float, default=60, help='Seconds between sweeps with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            queried, settled = asyncio.run(self.sweep(options))
+            
+            # Apply the results now rather than waiting for apply_mpesa_callbacks
+            while apply_callbacks() == settings.MPESA_CALLBACK_BATCH_SIZE:
+                pass
+            
+            if queried or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Queried {queried} pending pushes, settled {settled}'))
+            
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    async def sweep(self, options):
+        try:
+            return await reconcile(
+                older_than=options['older_than'],
+                batch_size=options['batch_size'],
+                concurrency=options['concurrency'],
+                rate=options['rate']
+            )
+        finally:
+            await close_async_client()
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+from payments.fake_daraja import FakeDaraja
+
+class Command(BaseCommand):
+    help = 'Run a local stand-in for the Daraja API (set MPESA_BASE_URL to its address)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+        parser.add_argument('--jitter', type=float, default=0.0, help='Up to this many extra seconds, at random')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with a 503')
+        parser.add_argument('--decline-rate', type=float, default=0.0, help='Fraction of pushes the customer declines')
+        parser.add_argument('--drop-callback-rate', type=float, default=0.0, help='Fraction of callbacks never sent')
+        parser.add_argument('--callback-delay', type=float, default=2.0, help='Seconds between a push and its callback')
+        parser.add_argument('--callback-url', help="Send callbacks here instead of each push's CallBackURL")
+        parser.add_argument('--token-ttl', type=int, default=3599, help='Seconds an access token is valid')
+
+    def handle(self, *args, **options):
+        daraja = FakeDaraja(
+            host=options['host'],
+            port=options['port'],
+            latency=options['latency'],
+            jitter=options['jitter'],
+            error_rate=options['error_rate'],
+            decline_rate=options['decline_rate'],
+            drop_callback_rate=options['drop_callback_rate'],
+            callback_delay=options['callback_delay'],
+            callback_url=options['callback_url'],
+            token_ttl=options['token_ttl'],
+            log=self.stdout.write if options['verbosity'] > 1 else None
+        )
+        daraja.start()
+        self.stdout.write(self.style.SUCCESS(f'Fake Daraja listening on {daraja.url}'))
+        self.stdout.write(f'Run the app with MPESA_BASE_URL={daraja.url}; Ctrl+C to stop')
+
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            daraja.stop()
+            stats = ', '.join(f'{name}={count}' for name, count in daraja.stats.items())
+            self.stdout.write(f'\n{stats}')
@@ -0,0 +1,53 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from payments.jobs import claim_jobs, fail_stale_jobs, worker_run_job
+from payments.mpesa import MpesaService
+
+class Command(BaseCommand):
+    help = 'Send queued STK pushes to M-Pesa from a pool of threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=settings.MPESA_STK_PUSH_WORKERS, help='Pushes in flight at once')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the queue and exit')
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        poll_interval = options['poll_interval']
+        in_flight = set()
+        sent = 0
+        last_stale_check = 0.0
+        breaker = MpesaService().breaker
+        
+        self.stdout.write(f'STK push worker started with {threads} threads')
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            while True:
+                if time.monotonic() - last_stale_check > poll_interval * 30:
+                    fail_stale_jobs()
+                    last_stale_check = time.monotonic()
+                
+                # Only claim what the pool can start now, so other workers get the rest.
+                # While Daraja's circuit is open jobs stay queued rather than fail
+                if len(in_flight) < threads and not breaker.is_open():
+                    claimed = claim_jobs(threads - len(in_flight))
+                else:
+                    claimed = []
+                for job in claimed:
+                    in_flight.add(pool.submit(worker_run_job, job))
+                
+                if not in_flight:
+                    if options['once']:
+                        break
+                    time.sleep(poll_interval)
+                    continue
+                
+                done, in_flight = wait(in_flight, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    sent += 1
+                    if future.exception():
+                        self.stdout.write(self.style.ERROR(f'Job failed: {future.exception()}'))
+        
+        self.stdout.write(self.style.SUCCESS(f'Sent {sent} STK pushes'))
@@ -0,0 +1,53 @@
+# Generated by Django 6.0.1 on 2026-10-18 00:05
+
+import uuid
+from django.db import migrations, models
+
+
+def blank_to_null(apps, schema_editor):
+    # Payments whose push was never accepted all share '', which a unique
+    # index would reject; they have no CheckoutRequestID, so store NULL
+    Payment = apps.get_model('payments', 'Payment')
+    Payment.objects.filter(checkout_request_id='').update(checkout_request_id=None)
+
+
+def null_to_blank(apps, schema_editor):
+    Payment = apps.get_model('payments', 'Payment')
+    Payment.objects.filter(checkout_request_id__isnull=True).update(checkout_request_id='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0002_stkpushjob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='checkout_request_id',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.RunPython(blank_to_null, null_to_blank),
+        migrations.AlterField(
+            model_name='payment',
+            name='checkout_request_id',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+        migrations.CreateModel(
+            name='MpesaCallback',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('checkout_request_id', models.CharField(max_length=100, unique=True)),
+                ('result_code', models.IntegerField()),
+                ('payload', models.JSONField()),
+                ('handler', models.CharField(max_length=200)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('applied', 'Applied'), ('unmatched', 'Unmatched'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('applied_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='mpesacallback_status_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 00:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_payment_status_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stkpushjob',
+            name='claimed_by',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 6.0.1 on 2026-10-18 01:05
+
+from django.db import migrations, models
+
+
+def mark_query_results(apps, schema_editor):
+    # Query results used to be told apart only by a 'Source' key in the payload
+    MpesaCallback = apps.get_model('payments', 'MpesaCallback')
+    MpesaCallback.objects.filter(payload__Source='stk_query').update(source='stk_query')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0005_stkpushjob_claimed_by'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mpesacallback',
+            name='source',
+            field=models.CharField(choices=[('callback', 'Callback'), ('stk_query', 'STK query')], default='callback', max_length=20),
+        ),
+        migrations.RunPython(mark_query_results, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='mpesacallback',
+            name='checkout_request_id',
+            field=models.CharField(max_length=100),
+        ),
+        migrations.AddConstraint(
+            model_name='mpesacallback',
+            constraint=models.UniqueConstraint(fields=('checkout_request_id', 'source'), name='mpesacallback_checkout_source_uniq'),
+        ),
+    ]
@@ -14,7 +14,7 @@ class Payment(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     description = models.TextField()
     merchant_request_id = models.CharField(max_length=100, blank=True)
-    checkout_request_id = models.CharField(max_length=100, blank=True)
+    checkout_request_id = models.CharField(max_length=100, unique=True, null=True, blank=True)
     mpesa_receipt_number = models.CharField(max_length=100, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -22,3 +22,98 @@ class Payment(models.Model):
     
     def __str__(self):
         return f"{self.phone_number} - {self.amount}"
+    
+    class Meta:
+        indexes = [
+            # The reconciler looks for payments left pending past a cutoff
+            models.Index(fields=['status', 'created_at'], name='payment_status_created_idx'),
+        ]
+
+
+class StkPushJob(models.Model):
+    """An STK push waiting to be sent to Daraja by the run_stk_push_worker command"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    phone_number = models.CharField(max_length=15)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    account_reference = models.CharField(max_length=100)
+    transaction_desc = models.CharField(max_length=100)
+    # Dotted path of a function(job, response) that applies the Daraja response
+    result_handler = models.CharField(max_length=200)
+    target_id = models.UUIDField()  # The order or payment the push is for
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    response = models.JSONField(null=True, blank=True)
+    claimed_by = models.CharField(max_length=32, blank=True)  # Token of the claim that set it running
+    started_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"STK push {self.account_reference} ({self.status})"
+    
+    class Meta:
+        indexes = [
+            # Workers claim the oldest queued jobs
+            models.Index(fields=['status', 'created_at'], name='stkpushjob_status_created_idx'),
+        ]
+
+
+class MpesaCallback(models.Model):
+    """A raw STK push callback, journalled on arrival and applied by apply_mpesa_callbacks"""
+    PENDING = 'pending'
+    APPLIED = 'applied'
+    UNMATCHED = 'unmatched'  # No order or payment has its CheckoutRequestID (yet)
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (APPLIED, 'Applied'),
+        (UNMATCHED, 'Unmatched'),
+        (FAILED, 'Failed'),
+    ]
+    CALLBACK = 'callback'
+    STK_QUERY = 'stk_query'  # An STK Push Query result, journalled by reconcile_stk_payments
+    SOURCE_CHOICES = [
+        (CALLBACK, 'Callback'),
+        (STK_QUERY, 'STK query'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # Unique per source, so a callback Safaricom delivers twice is only
+    # journalled once, but the real callback still lands after a query result
+    checkout_request_id = models.CharField(max_length=100)
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, default=CALLBACK)
+    result_code = models.IntegerField()
+    payload = models.JSONField()
+    # Dotted path of a function(callbacks) that applies a batch of callbacks
+    handler = models.CharField(max_length=200)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    created_at = models.DateTimeField(auto_now_add=True)
+    applied_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Callback {self.checkout_request_id} ({self.status})"
+    
+    @property
+    def metadata(self):
+        """CallbackMetadata items as a dict, e.g. {'MpesaReceiptNumber': ...}"""
+        items = self.payload['Body']['stkCallback'].get('CallbackMetadata', {}).get('Item', [])
+        return {item['Name']: item.get('Value') for item in items}
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['checkout_request_id', 'source'], name='mpesacallback_checkout_source_uniq'),
+        ]
+        indexes = [
+            # The worker applies the oldest pending callbacks first
+            models.Index(fields=['status', 'created_at'], name='mpesacallback_status_idx'),
+        ]
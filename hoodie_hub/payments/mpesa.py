@@ -1,9 +1,105 @@
 import requests
+import asyncio
 import base64
+import hashlib
+import os
+import random
+import threading
+import time
+import weakref
 from datetime import datetime
 from decouple import config
+import httpx
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 
+from .breaker import CircuitBreaker, unavailable_response
+
+# The OAuth token is shared by every process through the Django cache
+TOKEN_CACHE_KEY = 'payments:mpesa:token:{account}'
+TOKEN_LOCK_KEY = 'payments:mpesa:token:{account}:lock'
+TOKEN_LOCK_TIMEOUT = 15  # Seconds one caller may spend refreshing
+
+# Threads in this process wait here while one of them refreshes
+_token_lock = threading.Lock()
+
+# Responses worth retrying for idempotent calls
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# STK Push Query's answer for a push the customer hasn't settled yet; a
+# 500, but Daraja is working fine
+STILL_PROCESSING = '500.001.1001'
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Long-lived pooled HTTP session for Daraja, one per process.
+    
+    Keeps TLS connections to Safaricom alive between calls. A forked
+    worker builds its own so connections are never shared across processes.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=4,
+                    pool_maxsize=settings.MPESA_HTTP_POOL_SIZE,
+                    # Only failed connects are retried here: the request never
+                    # left, so this is safe even for a non-idempotent STK push
+                    max_retries=Retry(total=None, connect=2, read=0, status=0, other=0, backoff_factor=0.2)
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session, _session_pid = session, pid
+    return _session
+
+
+def get_timeout():
+    """(connect, read) timeout for Daraja calls"""
+    return (settings.MPESA_CONNECT_TIMEOUT, settings.MPESA_READ_TIMEOUT)
+
+
+def request_with_retries(method, url, **kwargs):
+    """Send an idempotent request, retrying transient failures.
+    
+    Connection errors, timeouts and 429/5xx responses are retried up to
+    MPESA_MAX_RETRIES times with exponential backoff and full jitter, so a
+    burst of callers doesn't retry in lockstep. STK Push Query's "still
+    processing" 500 is an answer, not a failure, and is returned at once.
+    """
+    retries = settings.MPESA_MAX_RETRIES
+    for attempt in range(retries + 1):
+        try:
+            response = get_session().request(method, url, timeout=get_timeout(), **kwargs)
+            if not upstream_failed(response) or attempt == retries:
+                return response
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt == retries:
+                raise
+        
+        backoff = min(settings.MPESA_RETRY_MAX_BACKOFF, settings.MPESA_RETRY_BACKOFF * 2 ** attempt)
+        time.sleep(random.uniform(0, backoff))
+
+
+def upstream_failed(response):
+    """Whether a Daraja response means the API itself is in trouble"""
+    if response.status_code not in RETRY_STATUSES:
+        return False
+    try:
+        return response.json().get('errorCode') != STILL_PROCESSING
+    except (ValueError, AttributeError):
+        return True
+
+
 class MpesaService:
     def __init__(self):
         self.consumer_key = config('MPESA_CONSUMER_KEY')
@@ -14,25 +110,88 @@ class MpesaService:
         
         self.environment = config('MPESA_ENVIRONMENT', default='sandbox')
         
+        # MPESA_BASE_URL points the client elsewhere, e.g. at `manage.py run_fake_daraja`
         if self.environment == 'sandbox':
-            self.auth_url = 'https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials'
-            self.stk_push_url = 'https://sandbox.safaricom.co.ke/mpesa/stkpush/v1/processrequest'
+            default_base_url = 'https://sandbox.safaricom.co.ke'
         else:
-            self.auth_url = 'https://api.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials'
-            self.stk_push_url = 'https://api.safaricom.co.ke/mpesa/stkpush/v1/processrequest'
+            default_base_url = 'https://api.safaricom.co.ke'
+        self.base_url = config('MPESA_BASE_URL', default=default_base_url).rstrip('/')
+        
+        self.auth_url = f'{self.base_url}/oauth/v1/generate?grant_type=client_credentials'
+        self.stk_push_url = f'{self.base_url}/mpesa/stkpush/v1/processrequest'
+        self.stk_query_url = f'{self.base_url}/mpesa/stkpushquery/v1/query'
         
+        # Shared by every process calling the same endpoint with the same credentials
+        self.breaker = CircuitBreaker(self._token_account)
+        
+    @property
+    def _token_account(self):
+        # Keyed by endpoint and credentials, never the secret itself
+        return hashlib.sha256(f"{self.base_url}:{self.consumer_key}".encode()).hexdigest()[:16]
+    
     def get_access_token(self):
-        """Get OAuth access token"""
+        """Get OAuth access token, from the shared cache when possible.
+        
+        Only one caller refreshes an expired token: threads in this process
+        queue on a lock and other processes wait on a cache lock, then all
+        of them pick up the new token from the cache.
+        """
+        token_key = TOKEN_CACHE_KEY.format(account=self._token_account)
+        token = cache.get(token_key)
+        if token:
+            return token
+        
+        with _token_lock:
+            token = cache.get(token_key)
+            if token:
+                return token
+            
+            lock_key = TOKEN_LOCK_KEY.format(account=self._token_account)
+            locked = cache.add(lock_key, True, TOKEN_LOCK_TIMEOUT)
+            if not locked:
+                # Another process is refreshing; wait for its token
+                deadline = time.monotonic() + TOKEN_LOCK_TIMEOUT
+                while time.monotonic() < deadline:
+                    time.sleep(0.1)
+                    token = cache.get(token_key)
+                    if token:
+                        return token
+                    if cache.get(lock_key) is None:
+                        break
+            
+            try:
+                token, expires_in = self.fetch_access_token()
+                if token:
+                    # Refresh a little early so a token never expires mid-request
+                    timeout = max(expires_in - settings.MPESA_TOKEN_REFRESH_MARGIN, 1)
+                    cache.set(token_key, token, timeout)
+                return token
+            finally:
+                # Never release another process's lock after giving up waiting
+                if locked:
+                    cache.delete(lock_key)
+    
+    def invalidate_access_token(self, token):
+        """Drop a token Daraja rejected, unless another caller already replaced it"""
+        token_key = TOKEN_CACHE_KEY.format(account=self._token_account)
+        if cache.get(token_key) == token:
+            cache.delete(token_key)
+    
+    def fetch_access_token(self):
+        """Request a new OAuth access token, returning (token, expires_in)"""
         try:
-            response = requests.get(
+            response = self._send(
+                'GET',
                 self.auth_url,
+                idempotent=True,
                 auth=(self.consumer_key, self.consumer_secret)
             )
             response.raise_for_status()
-            return response.json().get('access_token')
-        except requests.exceptions.RequestException as e:
+            data = response.json()
+            return data.get('access_token'), int(data.get('expires_in', 3599))
+        except (requests.exceptions.RequestException, ValueError) as e:
             print(f"Error getting access token: {e}")
-            return None
+            return None, 0
     
     def generate_password(self):
         """Generate password for STK push"""
@@ -41,32 +200,21 @@ class MpesaService:
         encoded = base64.b64encode(data_to_encode.encode())
         return encoded.decode('utf-8'), timestamp
     
-    def stk_push(self, phone_number, amount, account_reference, transaction_desc):
-        """Initiate STK push"""
-        access_token = self.get_access_token()
-        
-        if not access_token:
-            return {
-                'ResponseCode': '1',
-                'errorMessage': 'Failed to get access token'
-            }
-        
-        password, timestamp = self.generate_password()
-        
-        # Format phone number (remove leading 0, add 254)
+    def format_phone_number(self, phone_number):
+        """Format phone number (remove leading 0, add 254)"""
         if phone_number.startswith('0'):
             phone_number = '254' + phone_number[1:]
         elif phone_number.startswith('+254'):
             phone_number = phone_number[1:]
         elif not phone_number.startswith('254'):
             phone_number = '254' + phone_number
+        return phone_number
+    
+    def stk_push_payload(self, phone_number, amount, account_reference, transaction_desc):
+        password, timestamp = self.generate_password()
+        phone_number = self.format_phone_number(phone_number)
         
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
-        
-        payload = {
+        return {
             'BusinessShortCode': self.shortcode,
             'Password': password,
             'Timestamp': timestamp,
@@ -79,14 +227,33 @@ class MpesaService:
             'AccountReference': account_reference,
             'TransactionDesc': transaction_desc
         }
+    
+    def stk_query_payload(self, checkout_request_id):
+        password, timestamp = self.generate_password()
+        return {
+            'BusinessShortCode': self.shortcode,
+            'Password': password,
+            'Timestamp': timestamp,
+            'CheckoutRequestID': checkout_request_id
+        }
+    
+    def stk_push(self, phone_number, amount, account_reference, transaction_desc):
+        """Initiate STK push"""
+        if not self.breaker.allow():
+            return unavailable_response()
+        
+        access_token = self.get_access_token()
+        
+        if not access_token:
+            return {
+                'ResponseCode': '1',
+                'errorMessage': 'Failed to get access token'
+            }
+        
+        payload = self.stk_push_payload(phone_number, amount, account_reference, transaction_desc)
         
         try:
-            response = requests.post(
-                self.stk_push_url, 
-                json=payload, 
-                headers=headers,
-                timeout=30
-            )
+            response = self._post_with_token(self.stk_push_url, payload, access_token)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -94,4 +261,285 @@ class MpesaService:
             return {
                 'ResponseCode': '1',
                 'errorMessage': str(e)
-            }
\ No newline at end of file
+            }
+    
+    def stk_query(self, checkout_request_id):
+        """Ask Daraja for the outcome of an earlier STK push.
+        
+        A query changes nothing on Daraja's side, so unlike stk_push it is
+        retried on timeouts and 5xx responses.
+        """
+        if not self.breaker.allow():
+            return unavailable_response()
+        
+        access_token = self.get_access_token()
+        
+        if not access_token:
+            return {
+                'ResponseCode': '1',
+                'errorMessage': 'Failed to get access token'
+            }
+        
+        payload = self.stk_query_payload(checkout_request_id)
+        
+        try:
+            response = self._post_with_token(self.stk_query_url, payload, access_token, idempotent=True)
+            # Daraja answers a push that is still being processed with a 500
+            # and an errorCode, which callers need to see
+            if response.status_code >= 500 and response.content:
+                return response.json()
+            response.raise_for_status()
+            return response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"Error querying STK push {checkout_request_id}: {e}")
+            return {
+                'ResponseCode': '1',
+                'errorMessage': str(e)
+            }
+    
+    def _post_with_token(self, url, payload, access_token, idempotent=False):
+        """POST with a bearer token, fetching a new token once if Daraja rejects it"""
+        for attempt in range(2):
+            headers = {
+                'Authorization': f'Bearer {access_token}',
+                'Content-Type': 'application/json'
+            }
+            response = self._send('POST', url, idempotent=idempotent, json=payload, headers=headers)
+            if response.status_code != 401 or attempt:
+                break
+            
+            # Revoked or expired early: replace the cached token and retry once
+            self.invalidate_access_token(access_token)
+            access_token = self.get_access_token()
+            if not access_token:
+                break
+        return response
+    
+    def _send(self, method, url, idempotent=False, **kwargs):
+        """Send a request to Daraja and report how it went to the circuit breaker"""
+        started_at = time.time()
+        try:
+            if idempotent:
+                response = request_with_retries(method, url, **kwargs)
+            else:
+                response = get_session().request(method, url, timeout=get_timeout(), **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self.breaker.record_failure(started_at)
+            raise
+        
+        if upstream_failed(response):
+            self.breaker.record_failure(started_at)
+        else:
+            self.breaker.record_success(started_at)
+        return response
+
+
+# ========== ASYNC CLIENT ==========
+#
+# The same API for async views under ASGI. Calls await the network instead
+# of holding a thread, so one worker process can keep hundreds of pushes in
+# flight. Token caching is shared with MpesaService through the same cache
+# keys, so sync and async callers never fetch a token the other already has.
+
+# Per event loop: neither an httpx client nor an asyncio.Lock may be used
+# from a loop other than the one it was first used on
+_async_clients = weakref.WeakKeyDictionary()
+_async_token_locks = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """Long-lived pooled httpx client for Daraja, one per event loop"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=settings.MPESA_ASYNC_POOL_SIZE,
+                max_keepalive_connections=settings.MPESA_ASYNC_POOL_SIZE
+            ),
+            # Only failed connects, as for the sync session
+            retries=2
+        )
+        client = httpx.AsyncClient(
+            transport=transport,
+            timeout=httpx.Timeout(settings.MPESA_READ_TIMEOUT, connect=settings.MPESA_CONNECT_TIMEOUT)
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def close_async_client():
+    """Close this event loop's client, for code that runs its own short-lived loop"""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def _get_async_token_lock():
+    loop = asyncio.get_running_loop()
+    lock = _async_token_locks.get(loop)
+    if lock is None:
+        lock = _async_token_locks[loop] = asyncio.Lock()
+    return lock
+
+
+async def arequest_with_retries(method, url, **kwargs):
+    """Async request_with_retries"""
+    retries = settings.MPESA_MAX_RETRIES
+    for attempt in range(retries + 1):
+        try:
+            response = await get_async_client().request(method, url, **kwargs)
+            if not upstream_failed(response) or attempt == retries:
+                return response
+        except httpx.TransportError:
+            if attempt == retries:
+                raise
+        
+        backoff = min(settings.MPESA_RETRY_MAX_BACKOFF, settings.MPESA_RETRY_BACKOFF * 2 ** attempt)
+        await asyncio.sleep(random.uniform(0, backoff))
+
+
+class AsyncMpesaService(MpesaService):
+    """MpesaService whose network calls are coroutines"""
+    
+    async def get_access_token(self):
+        """Get OAuth access token, from the shared cache when possible"""
+        token_key = TOKEN_CACHE_KEY.format(account=self._token_account)
+        token = await cache.aget(token_key)
+        if token:
+            return token
+        
+        async with _get_async_token_lock():
+            token = await cache.aget(token_key)
+            if token:
+                return token
+            
+            lock_key = TOKEN_LOCK_KEY.format(account=self._token_account)
+            locked = await cache.aadd(lock_key, True, TOKEN_LOCK_TIMEOUT)
+            if not locked:
+                # Another process (or a sync caller) is refreshing
+                deadline = time.monotonic() + TOKEN_LOCK_TIMEOUT
+                while time.monotonic() < deadline:
+                    await asyncio.sleep(0.1)
+                    token = await cache.aget(token_key)
+                    if token:
+                        return token
+                    if await cache.aget(lock_key) is None:
+                        break
+            
+            try:
+                token, expires_in = await self.fetch_access_token()
+                if token:
+                    timeout = max(expires_in - settings.MPESA_TOKEN_REFRESH_MARGIN, 1)
+                    await cache.aset(token_key, token, timeout)
+                return token
+            finally:
+                if locked:
+                    await cache.adelete(lock_key)
+    
+    async def invalidate_access_token(self, token):
+        token_key = TOKEN_CACHE_KEY.format(account=self._token_account)
+        if await cache.aget(token_key) == token:
+            await cache.adelete(token_key)
+    
+    async def fetch_access_token(self):
+        try:
+            response = await self._send(
+                'GET',
+                self.auth_url,
+                idempotent=True,
+                auth=(self.consumer_key, self.consumer_secret)
+            )
+            response.raise_for_status()
+            data = response.json()
+            return data.get('access_token'), int(data.get('expires_in', 3599))
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"Error getting access token: {e}")
+            return None, 0
+    
+    async def stk_push(self, phone_number, amount, account_reference, transaction_desc):
+        """Initiate STK push"""
+        if not await self.breaker.aallow():
+            return unavailable_response()
+        
+        access_token = await self.get_access_token()
+        
+        if not access_token:
+            return {
+                'ResponseCode': '1',
+                'errorMessage': 'Failed to get access token'
+            }
+        
+        payload = self.stk_push_payload(phone_number, amount, account_reference, transaction_desc)
+        
+        try:
+            response = await self._post_with_token(self.stk_push_url, payload, access_token)
+            response.raise_for_status()
+            return response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"Error initiating STK push: {e}")
+            return {
+                'ResponseCode': '1',
+                'errorMessage': str(e)
+            }
+    
+    async def stk_query(self, checkout_request_id):
+        """Ask Daraja for the outcome of an earlier STK push"""
+        if not await self.breaker.aallow():
+            return unavailable_response()
+        
+        access_token = await self.get_access_token()
+        
+        if not access_token:
+            return {
+                'ResponseCode': '1',
+                'errorMessage': 'Failed to get access token'
+            }
+        
+        payload = self.stk_query_payload(checkout_request_id)
+        
+        try:
+            response = await self._post_with_token(self.stk_query_url, payload, access_token, idempotent=True)
+            if response.status_code >= 500 and response.content:
+                return response.json()
+            response.raise_for_status()
+            return response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"Error querying STK push {checkout_request_id}: {e}")
+            return {
+                'ResponseCode': '1',
+                'errorMessage': str(e)
+            }
+    
+    async def _post_with_token(self, url, payload, access_token, idempotent=False):
+        for attempt in range(2):
+            headers = {
+                'Authorization': f'Bearer {access_token}',
+                'Content-Type': 'application/json'
+            }
+            response = await self._send('POST', url, idempotent=idempotent, json=payload, headers=headers)
+            if response.status_code != 401 or attempt:
+                break
+            
+            await self.invalidate_access_token(access_token)
+            access_token = await self.get_access_token()
+            if not access_token:
+                break
+        return response
+    
+    async def _send(self, method, url, idempotent=False, **kwargs):
+        started_at = time.time()
+        try:
+            if idempotent:
+                response = await arequest_with_retries(method, url, **kwargs)
+            else:
+                response = await get_async_client().request(method, url, **kwargs)
+        except httpx.TransportError:
+            await self.breaker.arecord_failure(started_at)
+            raise
+        
+        if upstream_failed(response):
+            await self.breaker.arecord_failure(started_at)
+        else:
+            await self.breaker.arecord_success(started_at)
+        return response
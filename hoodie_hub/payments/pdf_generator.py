@@ -12,7 +12,9 @@ class OrderReceiptGenerator:
     def generate(self):
         """Generate PDF receipt for order"""
         buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4)
+        # Invariant output (no timestamp or random document id) so the same
+        # order always renders to the same bytes
+        doc = SimpleDocTemplate(buffer, pagesize=A4, invariant=True)
         elements = []
         styles = getSampleStyleSheet()
         
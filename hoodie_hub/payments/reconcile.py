@@ -0,0 +1,139 @@
+"""Settle STK pushes whose callback never arrived.
+
+``manage.py reconcile_stk_payments`` finds orders and payments still
+pending well after their push was accepted and asks Daraja's STK Push Query
+API how each one ended. Queries run concurrently on the async client, at no
+more than MPESA_RECONCILE_RATE per second. A final answer is journalled as
+the callback that went missing (see payments.callbacks), so it is settled by
+the same handler. A query can't return the receipt number; if the real
+callback arrives later it is still applied and fills that in.
+"""
+import asyncio
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .breaker import is_unavailable
+from .callbacks import record_callback
+from .models import MpesaCallback
+from .mpesa import AsyncMpesaService
+
+
+class RateLimiter:
+    """Spaces calls out to at most ``rate`` per second across coroutines"""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_at = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            delay = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def stale_batch(model_label, pending_status, older_than, after, batch_size):
+    """Next ``batch_size`` pending rows with an accepted push and no applied or pending callback.
+
+    A callback that failed to apply (or never matched) leaves the row to be
+    queried like one whose callback never came. Walks the (status, created_at) index in created_at order; ``after`` is
+    the (created_at, pk) of the last row of the previous batch.
+    """
+    model = apps.get_model(model_label)
+    rows = (
+        model.objects
+        .filter(
+            status=pending_status,
+            created_at__lt=timezone.now() - timedelta(seconds=older_than),
+            checkout_request_id__isnull=False
+        )
+        .exclude(Exists(MpesaCallback.objects.filter(
+            checkout_request_id=OuterRef('checkout_request_id'),
+            status__in=[MpesaCallback.APPLIED, MpesaCallback.PENDING]
+        )))
+        .order_by('created_at', 'pk')
+    )
+    if after is not None:
+        created_at, pk = after
+        rows = rows.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk))
+    return list(rows.values_list('created_at', 'pk', 'checkout_request_id')[:batch_size])
+
+
+def query_result_code(response):
+    """The STK push's final ResultCode from a query response, or None if it isn't known yet"""
+    if response.get('ResponseCode') != '0' or 'ResultCode' not in response:
+        # Still being processed, or the query itself failed
+        return None
+    try:
+        return int(response['ResultCode'])
+    except (TypeError, ValueError):
+        return None
+
+
+def record_results(handler, results):
+    """Journal each final query result as its STK callback, returning how many were final"""
+    recorded = 0
+    for checkout_request_id, response in results:
+        result_code = query_result_code(response)
+        if result_code is None:
+            continue
+        data = {
+            'Body': {
+                'stkCallback': {
+                    'MerchantRequestID': response.get('MerchantRequestID', ''),
+                    'CheckoutRequestID': checkout_request_id,
+                    'ResultCode': result_code,
+                    'ResultDesc': response.get('ResultDesc', ''),
+                }
+            }
+        }
+        record_callback(data, handler, source=MpesaCallback.STK_QUERY)
+        # An earlier query result that failed to apply is tried again with this one
+        MpesaCallback.objects.filter(
+            checkout_request_id=checkout_request_id,
+            source=MpesaCallback.STK_QUERY,
+            status__in=[MpesaCallback.FAILED, MpesaCallback.UNMATCHED]
+        ).update(status=MpesaCallback.PENDING, result_code=result_code, payload=data, handler=handler)
+        recorded += 1
+    return recorded
+
+
+async def reconcile(older_than=None, batch_size=100, concurrency=None, rate=None):
+    """Query Daraja for every stale push, returning (queried, settled)"""
+    older_than = settings.MPESA_RECONCILE_AFTER if older_than is None else older_than
+    semaphore = asyncio.Semaphore(concurrency or settings.MPESA_RECONCILE_CONCURRENCY)
+    limiter = RateLimiter(rate or settings.MPESA_RECONCILE_RATE)
+    service = AsyncMpesaService()
+
+    async def query(checkout_request_id):
+        async with semaphore:
+            await limiter.wait()
+            return checkout_request_id, await service.stk_query(checkout_request_id)
+
+    queried = settled = 0
+    for model_label, pending_status, handler in settings.MPESA_RECONCILE_TARGETS:
+        after = None
+        while True:
+            rows = await sync_to_async(stale_batch)(model_label, pending_status, older_than, after, batch_size)
+            if not rows:
+                break
+
+            results = await asyncio.gather(*[query(checkout_request_id) for _, _, checkout_request_id in rows])
+            settled += await sync_to_async(record_results)(handler, results)
+            queried += len(rows)
+            after = rows[-1][:2]
+
+            if any(is_unavailable(response) for _, response in results):
+                # Daraja is down; the next sweep picks up where this one stopped
+                print("Daraja circuit is open, stopping reconciliation")
+                return queried, settled
+
+    return queried, settled
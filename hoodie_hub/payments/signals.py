@@ -0,0 +1,10 @@
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .models import Payment
+from .status import publish_payment_status
+
+@receiver(post_save, sender=Payment)
+def update_payment_status(sender, instance, **kwargs):
+    """Write the payment's status projection through to the cache after commit"""
+    transaction.on_commit(lambda: publish_payment_status(instance))
@@ -0,0 +1,65 @@
+"""Cached payment status, so payment_status polls normally skip the database.
+
+The projection is written through whenever a payment is saved or settled;
+ids that don't exist are cached briefly as well. Payments are settled by
+the callback and reconcile commands in their own processes, so this only
+caches when the cache is shared between processes (e.g. Redis or
+Memcached); with a per-process cache every read goes to the database.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Payment
+
+STATUS_KEY = 'payments:payment-status:{payment_id}'
+
+# Backends whose contents other processes can't see
+LOCAL_CACHE_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+def status_cache_enabled():
+    """Whether status projections are cached, i.e. the default cache is shared"""
+    return settings.CACHES['default']['BACKEND'] not in LOCAL_CACHE_BACKENDS
+
+
+def payment_state(status, amount, phone_number, mpesa_receipt_number):
+    return {
+        'status': status,
+        'amount': str(Decimal(amount).quantize(Decimal('0.01'))),
+        'phone_number': phone_number,
+        'receipt_number': mpesa_receipt_number or ''
+    }
+
+
+def publish_payment_status(payment):
+    """Write a payment's status through to the cache"""
+    if not status_cache_enabled():
+        return
+    state = payment_state(payment.status, payment.amount, payment.phone_number, payment.mpesa_receipt_number)
+    cache.set(STATUS_KEY.format(payment_id=payment.pk), state, settings.PAYMENT_STATUS_CACHE_TIMEOUT)
+
+
+def get_payment_status(payment_id):
+    """A payment's cached status, read from the database only on a miss.
+
+    Returns None if there is no such payment.
+    """
+    cached = status_cache_enabled()
+    key = STATUS_KEY.format(payment_id=payment_id)
+    state = cache.get(key) if cached else None
+    if state is None:
+        row = Payment.objects.filter(id=payment_id).values_list(
+            'status', 'amount', 'phone_number', 'mpesa_receipt_number'
+        ).first()
+        state = payment_state(*row) if row else False
+        if cached:
+            # add(), not set(): a settle published since the read above must win.
+            # Misses are remembered too, but not for long
+            timeout = settings.PAYMENT_STATUS_CACHE_TIMEOUT if row else settings.STATUS_MISSING_CACHE_TIMEOUT
+            cache.add(key, state, timeout)
+    return state or None
@@ -1,3 +1,94 @@
+import os
+from datetime import timedelta
+from unittest import mock
+
 from django.test import TestCase
+from django.utils import timezone
+
+from .fake_daraja import FakeDaraja
+from .jobs import claim_jobs, fail_stale_jobs, finish_job
+from .models import StkPushJob
+from .mpesa import STILL_PROCESSING, MpesaService
+
+
+def create_job():
+    return StkPushJob.objects.create(
+        phone_number='254712345678',
+        amount=100,
+        account_reference='REF',
+        transaction_desc='Test',
+        result_handler='payments.jobs.apply_payment_result',
+        target_id='00000000-0000-0000-0000-000000000000'
+    )
+
+
+class ClaimJobsTests(TestCase):
+
+    def test_concurrent_claims_never_share_a_job(self):
+        jobs = {create_job().id for _ in range(3)}
+
+        # Another worker claims the same jobs after this one has read their
+        # ids but before it marks them running, as it can without SKIP LOCKED
+        rival_claims = []
+        real_now = timezone.now
+
+        def now_after_rival_claims():
+            if not rival_claims:
+                rival_claims.append(None)
+                rival_claims.append(claim_jobs(10))
+            return real_now()
+
+        with mock.patch('payments.jobs.timezone.now', side_effect=now_after_rival_claims):
+            claimed = claim_jobs(10)
+
+        rival = rival_claims[1]
+        self.assertEqual({job.id for job in rival}, jobs)
+        self.assertEqual(claimed, [])
+        self.assertEqual(StkPushJob.objects.filter(status=StkPushJob.RUNNING).count(), 3)
+
+    def test_claim_respects_limit(self):
+        for _ in range(3):
+            create_job()
+
+        first = claim_jobs(2)
+        second = claim_jobs(2)
+
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse({job.id for job in first} & {job.id for job in second})
+
+
+class FinishJobTests(TestCase):
+    def test_swept_job_keeps_its_failure(self):
+        create_job()
+        job, = claim_jobs(1)
+        StkPushJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(days=1))
+        fail_stale_jobs()
+
+        # The worker that claimed it finally hears back from Daraja
+        finish_job(job, {'ResponseCode': '0', 'CheckoutRequestID': 'ws_CO_1'})
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, StkPushJob.FAILED)
+        self.assertEqual(job.response['errorMessage'], 'Payment request timed out')
+
+
+class StkQueryTests(TestCase):
+    def test_pending_query_is_not_retried(self):
+        with FakeDaraja(callback_delay=60) as daraja:
+            env = {
+                'MPESA_CONSUMER_KEY': 'key',
+                'MPESA_CONSUMER_SECRET': 'secret',
+                'MPESA_SHORTCODE': '174379',
+                'MPESA_PASSKEY': 'passkey',
+                'MPESA_CALLBACK_URL': 'http://127.0.0.1:9/callback',
+                'MPESA_BASE_URL': daraja.url,
+            }
+            with mock.patch.dict(os.environ, env):
+                mpesa = MpesaService()
+                push = mpesa.stk_push('0712345678', 100, 'REF', 'Test')
+                response = mpesa.stk_query(push['CheckoutRequestID'])
 
-# Create your tests here.
+            self.assertEqual(response['errorCode'], STILL_PROCESSING)
+            self.assertEqual(daraja.stats['queries'], 1)
+            self.assertFalse(mpesa.breaker.is_open())
@@ -1,90 +1,81 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, Http404
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
+from django.db import transaction
+from asgiref.sync import sync_to_async
 import json
-from .models import Payment
+from .breaker import UNAVAILABLE_MESSAGE, is_unavailable
+from .models import Payment, StkPushJob
+from .callbacks import record_callback
+from .jobs import create_stk_push_job, send_inline
 from .mpesa import MpesaService
 from .pdf_generator import OrderReceiptGenerator
+from .status import get_payment_status
 
 def payment_form(request):
     """Display payment form"""
     return render(request, 'payments/payment_form.html')
 
-def initiate_payment(request):
-    """Initiate STK push"""
-    if request.method == 'POST':
-        phone_number = request.POST.get('phone_number')
-        amount = request.POST.get('amount')
-        description = request.POST.get('description', 'Payment')
-        
-        # Create payment record
+def create_payment(phone_number, amount, description):
+    """Create a payment record and queue its STK push"""
+    with transaction.atomic():
         payment = Payment.objects.create(
             phone_number=phone_number,
             amount=amount,
             description=description
         )
         
-        # Initiate STK push
-        mpesa = MpesaService()
-        response = mpesa.stk_push(
+        # payment_status reports the result
+        job = create_stk_push_job(
+            target_id=payment.id,
+            result_handler='payments.jobs.apply_payment_result',
             phone_number=phone_number,
             amount=amount,
             account_reference=str(payment.id),
             transaction_desc=description
         )
+    return payment, job
+
+async def initiate_payment(request):
+    """Initiate STK push"""
+    if request.method == 'POST':
+        phone_number = request.POST.get('phone_number')
+        amount = request.POST.get('amount')
+        description = request.POST.get('description', 'Payment')
+        
+        # Fail fast while Daraja is down instead of queueing a push that can't go
+        if await MpesaService().breaker.ais_open():
+            return JsonResponse({'success': False, 'message': UNAVAILABLE_MESSAGE})
+        
+        payment, job = await sync_to_async(create_payment)(phone_number, amount, description)
+        await send_inline(job)
+        if job.status == StkPushJob.FAILED:
+            # Sent inline and refused; the payment has been failed
+            if is_unavailable(job.response):
+                message = UNAVAILABLE_MESSAGE
+            else:
+                message = job.response.get('errorMessage', 'Payment failed')
+            return JsonResponse({'success': False, 'message': message})
         
-        # Update payment with M-Pesa details
-        if response.get('ResponseCode') == '0':
-            payment.merchant_request_id = response.get('MerchantRequestID')
-            payment.checkout_request_id = response.get('CheckoutRequestID')
-            payment.save()
-            
-            return JsonResponse({
-                'success': True,
-                'message': 'Please check your phone to complete payment',
-                'payment_id': str(payment.id)
-            })
-        else:
-            payment.status = 'failed'
-            payment.save()
-            return JsonResponse({
-                'success': False,
-                'message': response.get('errorMessage', 'Payment failed')
-            })
+        return JsonResponse({
+            'success': True,
+            'message': 'Please check your phone to complete payment',
+            'payment_id': str(payment.id)
+        })
     
     return JsonResponse({'success': False, 'message': 'Invalid request'})
 
 @csrf_exempt
 @require_http_methods(["POST"])
 def mpesa_callback(request):
-    """Handle M-Pesa callback"""
+    """Journal an M-Pesa payment callback and ACK; apply_mpesa_callbacks applies it"""
     try:
-        data = json.loads(request.body)
-        
-        # Extract callback data
-        result_code = data['Body']['stkCallback']['ResultCode']
-        checkout_request_id = data['Body']['stkCallback']['CheckoutRequestID']
-        
-        # Find payment
-        payment = Payment.objects.get(checkout_request_id=checkout_request_id)
-        
-        if result_code == 0:
-            # Payment successful
-            callback_metadata = data['Body']['stkCallback']['CallbackMetadata']['Item']
-            for item in callback_metadata:
-                if item['Name'] == 'MpesaReceiptNumber':
-                    payment.mpesa_receipt_number = item['Value']
-            
-            payment.status = 'completed'
-        else:
-            payment.status = 'failed'
-        
-        payment.save()
-        
-        return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Accepted'})
-    except Exception as e:
+        record_callback(json.loads(request.body), 'payments.callbacks.apply_payment_callbacks')
+    except (KeyError, TypeError, ValueError) as e:
         return JsonResponse({'ResultCode': 1, 'ResultDesc': str(e)})
+    
+    return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Accepted'})
 
 def download_receipt(request, payment_id):
     """Generate and download PDF receipt"""
@@ -104,11 +95,8 @@ def download_receipt(request, payment_id):
     return response
 
 def payment_status(request, payment_id):
-    """Check payment status"""
-    payment = get_object_or_404(Payment, id=payment_id)
-    return JsonResponse({
-        'status': payment.status,
-        'amount': str(payment.amount),
-        'phone_number': payment.phone_number,
-        'receipt_number': payment.mpesa_receipt_number or ''
-    })
\ No newline at end of file
+    """Check payment status, from the cache when possible"""
+    state = get_payment_status(payment_id)
+    if state is None:
+        raise Http404('Payment not found')
+    return JsonResponse(state)
\ No newline at end of file